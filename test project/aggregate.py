@@ -0,0 +1,232 @@
+import os
+import csv
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent.futures import as_completed
+from tqdm import tqdm
+import numpy as np
+from json_stream import is_shard
+from game_store import (GameStore, STORE_CHUNK_GAMES, is_game_store,
+                        iter_json_games, iter_store_games)
+from overlap import make_executor, load_result
+from metrics import run_task
+from data_process import COLORS, PHASES, game_phase, move_id_to_str
+
+# 通用分组统计：每份报表由若干维度和若干指标组成，所有报表在一次遍历中同时统计。
+# 维度是 (对局, 步数) -> 分组值的函数，可以写内置维度名，也可以写 (列名, 函数)，
+# 函数需定义在模块顶层以便传给工作进程。
+# 指标：
+#   frequency 该分组下的着法次数
+#   games     该分组下出现过的不同对局数
+#   wins      着法次数中走这一步的一方最终获胜的次数
+# 计数表为稀疏字典 {分组值元组: [frequency, games, wins]}
+ReportSpec = namedtuple('ReportSpec', ['name', 'by', 'measures'])
+MEASURES = ('frequency', 'games', 'wins')
+MOVE_SHIFTS = (15, 12, 9, 6, 3, 0)
+
+
+def dimension_move(game, ply):
+    return game['moves'][ply]
+
+
+def dimension_color(game, ply):
+    return COLORS[ply % 2]
+
+
+def dimension_phase(game, ply):
+    return PHASES[game_phase(ply)]
+
+
+def dimension_ply(game, ply):
+    return ply
+
+
+def dimension_bot(game, ply):
+    return game['bots'][ply % 2]
+
+
+def dimension_opponent_bot(game, ply):
+    return game['bots'][1 - ply % 2]
+
+
+def dimension_winner(game, ply):
+    return COLORS[game['winner']]
+
+
+def dimension_result(game, ply):
+    return 'win' if ply % 2 == game['winner'] else 'loss'
+
+
+def dimension_game_length(game, ply):
+    return len(game['moves'])
+
+
+DIMENSIONS = {
+    'move': dimension_move,
+    'color': dimension_color,
+    'phase': dimension_phase,
+    'ply': dimension_ply,
+    'bot': dimension_bot,
+    'opponent_bot': dimension_opponent_bot,
+    'winner': dimension_winner,
+    'result': dimension_result,
+    'game_length': dimension_game_length,
+}
+
+
+class Bucket:
+    # 把步数或对局长度按分界点分段，例如 Bucket('ply', (12, 44)) 分为 0-11、12-43、44-
+
+    def __init__(self, field, edges):
+        self.field = field
+        self.edges = tuple(edges)
+        self.name = f"{field}_bucket"
+
+    def __call__(self, game, ply):
+        value = ply if self.field == 'ply' else len(game['moves'])
+        i = bisect_right(self.edges, value)
+        low = self.edges[i - 1] if i > 0 else 0
+        high = str(self.edges[i] - 1) if i < len(self.edges) else ''
+        return f"{low}-{high}"
+
+
+def resolve_dimension(dimension):
+    if isinstance(dimension, str):
+        return dimension, DIMENSIONS[dimension]
+    if isinstance(dimension, Bucket):
+        return dimension.name, dimension
+    return dimension
+
+
+def game_dicts(games):
+    # 维度函数看到的对局：着法为 encode_move 的编号
+    for game in games:
+        moves = np.asarray(game.moves, dtype=np.int64).reshape(-1, 6)
+        yield {
+            'moves': (moves << MOVE_SHIFTS).sum(axis=1).tolist(),
+            'winner': game.winner,
+            'bots': game.bots
+        }
+
+
+def aggregate_games(games, specs):
+    dimensions = [[resolve_dimension(d)[1] for d in spec.by] for spec in specs]
+    tables = [{} for _ in specs]
+    for game in games:
+        seen = [set() for _ in specs]
+        winner = game['winner']
+        for ply in range(len(game['moves'])):
+            won = ply % 2 == winner
+            for functions, table, keys in zip(dimensions, tables, seen):
+                key = tuple(function(game, ply) for function in functions)
+                counts = table.get(key)
+                if counts is None:
+                    counts = table[key] = [0, 0, 0]
+                counts[0] += 1
+                counts[2] += won
+                keys.add(key)
+        for table, keys in zip(tables, seen):
+            for key in keys:
+                table[key][1] += 1
+    return {spec.name: table for spec, table in zip(specs, tables)}
+
+
+def merge_tables(target, source):
+    for name, table in source.items():
+        target_table = target.setdefault(name, {})
+        for key, counts in table.items():
+            target_counts = target_table.get(key)
+            if target_counts is None:
+                target_table[key] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    target_counts[i] += count
+
+
+def process_file(file_path, specs):
+    try:
+        return aggregate_games(game_dicts(iter_json_games(file_path)), specs)
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        return {}
+
+
+def process_store_chunk(store_path, start, stop, specs):
+    return aggregate_games(
+        game_dicts(iter_store_games(store_path, start, stop)), specs)
+
+
+def sort_key(key):
+    # bot 等维度可能为 None，排在同列其他值之后
+    return tuple(
+        (value is None, value if value is not None else 0) for value in key)
+
+
+def write_report(table, spec, file_path):
+    columns = [resolve_dimension(d)[0] for d in spec.by]
+    measures = list(spec.measures)
+    if 'frequency' in measures and 'wins' in measures:
+        measures.append('win_rate')
+    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns + measures)
+        for key in sorted(table, key=sort_key):
+            frequency, games, wins = table[key]
+            values = {
+                'frequency': frequency,
+                'games': games,
+                'wins': wins,
+                'win_rate': wins / frequency
+            }
+            row = [
+                move_id_to_str(value) if column == 'move' else value
+                for column, value in zip(columns, key)
+            ]
+            writer.writerow(row + [values[measure] for measure in measures])
+
+
+def process_directory(directory_path, specs, max_workers=8, overlapped=False):
+    for spec in specs:
+        for measure in spec.measures:
+            if measure not in MEASURES:
+                raise ValueError(f"未知的统计指标: {measure}")
+
+    if is_game_store(directory_path):
+        total_games = len(GameStore(directory_path))
+        tasks = [(process_store_chunk, directory_path, start,
+                  start + STORE_CHUNK_GAMES, specs)
+                 for start in range(0, total_games, STORE_CHUNK_GAMES)]
+    else:
+        tasks = [(process_file, os.path.join(directory_path, file), specs)
+                 for file in os.listdir(directory_path) if is_shard(file)]
+
+    tables = {spec.name: {} for spec in specs}
+    with make_executor(max_workers, overlapped) as executor:
+        futures = [
+            executor.submit(run_task, 'aggregate', index, *task)
+            for index, task in enumerate(tasks)
+        ]
+        for future in tqdm(as_completed(futures),
+                           total=len(futures),
+                           desc="Aggregating"):
+            merge_tables(tables, load_result(future.result()))
+    return tables
+
+
+DEFAULT_REPORTS = [
+    ReportSpec('chess_moves_by_phase', ('color', 'phase', 'move'),
+               ('frequency', 'wins')),
+    ReportSpec('chess_moves', ('color', 'move'), ('frequency', 'wins')),
+    ReportSpec('bot_results', ('bot', 'color', 'result'), ('games', )),
+    ReportSpec('game_length', (Bucket('game_length', (20, 40, 60, 80)), ),
+               ('games', )),
+]
+
+if __name__ == "__main__":
+    directory_path = r"E:\VSCPython\Amazons\dataset\merge"
+    output_directory = r"E:\VSCPython\Amazons\result_csv"
+    tables = process_directory(directory_path, DEFAULT_REPORTS)
+    for spec in DEFAULT_REPORTS:
+        write_report(tables[spec.name], spec,
+                     os.path.join(output_directory, f"{spec.name}.csv"))
+    print("所有报表已生成。")
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import multiprocessing
+from json_stream import iter_json_objects, is_shard
+from synthetic import SYNTHETIC_SEED, SYNTHETIC_VERSION, write_dataset
+import fix_json
+import compress_json
+import filter_json_err
+import filter_logs
+import merge_json
+import filter_bot
+import pipeline
+import game_store
+import data_process
+import aggregate
+import position_stats
+import opening_book
+import features
+import sampler
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource 模块，不统计内存峰值
+    resource = None
+
+# 在合成数据集上按顺序运行各阶段，每个阶段在独立的子进程中运行，
+# 统计耗时、games/s、MB/s 以及该子进程及其工作进程的内存峰值，结果写成 JSON 便于比较
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+    scale = 1 if sys.platform == 'darwin' else 1024
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / (1 << 20)
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def count_games(directory_path):
+    return sum(1 for file in os.listdir(directory_path) if is_shard(file)
+               for _ in iter_json_objects(os.path.join(directory_path, file)))
+
+
+def stage_fix_json(work):
+    fix_json.process_directory(work['raw'], recover=True)
+
+
+def stage_compress_json(work):
+    compress_json.process_directory(work['raw'])
+
+
+def stage_filter_json_err(work):
+    filter_json_err.process_directory(work['raw'])
+
+
+def stage_filter_logs(work):
+    filter_logs.process_directory(work['raw'])
+
+
+def stage_merge_json(work):
+    merge_json.process_directory(work['raw'], work['merge'])
+
+
+def stage_filter_bot(work):
+    filter_bot.process_directory(work['merge'], work['filter_bot'],
+                                 work['bots'])
+
+
+def stage_filter_bot_streaming(work):
+    filter_bot.process_directory(work['merge'],
+                                 work['filter_bot_streaming'],
+                                 work['bots'],
+                                 streaming=True)
+
+
+def stage_pipeline(work):
+    pipeline.process_directory(work['pipeline_raw'], work['pipeline_merge'])
+
+
+def stage_game_store(work):
+    game_store.process_directory(work['merge'], work['store'])
+
+
+def stage_data_process_batch(work):
+    data_process.process_directory(batch=True, directory_path=work['merge'])
+
+
+def stage_data_process_replay(work):
+    data_process.process_directory(batch=False, directory_path=work['merge'])
+
+
+def stage_data_process_store(work):
+    data_process.process_directory(batch=True, directory_path=work['store'])
+
+
+def stage_aggregate(work):
+    aggregate.process_directory(work['merge'], aggregate.DEFAULT_REPORTS)
+
+
+def stage_aggregate_overlapped(work):
+    aggregate.process_directory(work['merge'],
+                                aggregate.DEFAULT_REPORTS,
+                                overlapped=True)
+
+
+def stage_position_stats(work):
+    position_stats.process_directory(work['merge'])
+
+
+def stage_position_stats_overlapped(work):
+    position_stats.process_directory(work['merge'], overlapped=True)
+
+
+def stage_opening_book(work):
+    opening_book.process_directory(
+        work['merge'], os.path.join(work['output'], 'opening_book.npy'))
+
+
+def stage_features(work):
+    features.process_directory(work['merge'],
+                               os.path.join(work['output'], 'features.npz'))
+
+
+def stage_features_overlapped(work):
+    features.process_directory(work['merge'],
+                               os.path.join(work['output'], 'features.npz'),
+                               overlapped=True)
+
+
+def stage_sampler_index(work):
+    sampler.build_index(work['merge'],
+                        os.path.join(work['output'], 'game_index.npz'))
+
+
+# (阶段名, 函数, 输入目录)：输入为 raw 的阶段按原始对局数计，其余按合并后的对局数计
+STAGES = (
+    ('fix_json', stage_fix_json, 'raw'),
+    ('compress_json', stage_compress_json, 'raw'),
+    ('filter_json_err', stage_filter_json_err, 'raw'),
+    ('filter_logs', stage_filter_logs, 'raw'),
+    ('merge_json', stage_merge_json, 'raw'),
+    ('filter_bot', stage_filter_bot, 'merge'),
+    ('filter_bot_streaming', stage_filter_bot_streaming, 'merge'),
+    ('pipeline', stage_pipeline, 'pipeline_raw'),
+    ('game_store', stage_game_store, 'merge'),
+    ('data_process_batch', stage_data_process_batch, 'merge'),
+    ('data_process_replay', stage_data_process_replay, 'merge'),
+    ('data_process_store', stage_data_process_store, 'store'),
+    ('aggregate', stage_aggregate, 'merge'),
+    ('aggregate_overlapped', stage_aggregate_overlapped, 'merge'),
+    ('position_stats', stage_position_stats, 'merge'),
+    ('position_stats_overlapped', stage_position_stats_overlapped, 'merge'),
+    ('opening_book', stage_opening_book, 'merge'),
+    ('features', stage_features, 'merge'),
+    ('features_overlapped', stage_features_overlapped, 'merge'),
+    ('sampler_index', stage_sampler_index, 'merge'),
+)
+
+
+def run_stage(function, work, queue):
+    # 阶段本身的打印和进度条输出都丢弃，只回传计时和内存峰值；
+    # 在文件描述符层面重定向，之后启动的工作进程也一并生效
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    try:
+        start = time.perf_counter()
+        function(work)
+        queue.put({
+            'seconds': time.perf_counter() - start,
+            'peak_rss_mb': peak_rss_mb()
+        })
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+
+def measure_stage(function, work):
+    # spawn 出的子进程从干净的解释器启动，内存峰值不受主进程影响
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_stage, args=(function, work, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def write_bot_file(dataset_path, bot_file_path):
+    # filter_bot 按数据集中一半的 bot 筛选
+    bots = set()
+    for root, dirs, files in os.walk(dataset_path):
+        for file in files:
+            if is_shard(file):
+                for obj in iter_json_objects(os.path.join(root, file)):
+                    bots.update(player['bot'] for player in obj['players']
+                                if player['bot'] is not None)
+    with open(bot_file_path, 'w', encoding='utf-8') as file:
+        for bot in sorted(bots)[::2]:
+            file.write(bot + '\n')
+
+
+def prepare_dataset(output_directory, size, seed):
+    # 同样的规模和种子只生成一次，之后重复使用
+    dataset_path = os.path.join(output_directory, 'datasets',
+                                f"{size}_{seed}_v{SYNTHETIC_VERSION}")
+    if not os.path.isdir(dataset_path):
+        temp_path = dataset_path + '.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        write_dataset(temp_path, size, seed=seed)
+        os.replace(temp_path, dataset_path)
+    return dataset_path
+
+
+def benchmark_size(output_directory, size, seed, stage_names=None):
+    dataset_path = prepare_dataset(output_directory, size, seed)
+    work_directory = os.path.join(output_directory, f"work_{size}")
+    shutil.rmtree(work_directory, ignore_errors=True)
+    work = {
+        'raw':
+        os.path.join(work_directory, 'raw'),
+        'merge':
+        os.path.join(work_directory, 'merge'),
+        'pipeline_raw':
+        os.path.join(work_directory, 'pipeline_raw'),
+        'pipeline_merge':
+        os.path.join(work_directory, 'pipeline_merge'),
+        'store':
+        os.path.join(work_directory, 'store'),
+        'output':
+        os.path.join(work_directory, 'output'),
+        'filter_bot':
+        os.path.join(work_directory, 'filter_bot'),
+        'filter_bot_streaming':
+        os.path.join(work_directory, 'filter_bot_streaming'),
+    }
+    shutil.copytree(dataset_path, work['raw'])
+    shutil.copytree(dataset_path, work['pipeline_raw'])
+    os.makedirs(work['output'])
+    work['bots'] = os.path.join(work['output'], 'bots.txt')
+    write_bot_file(dataset_path, work['bots'])
+
+    results = []
+    merged_games = None
+    for name, function, input_key in STAGES:
+        if stage_names is not None and name not in stage_names:
+            continue
+        if not os.path.exists(work[input_key]):
+            print(f"跳过阶段 {name}: 缺少输入 {work[input_key]}")
+            continue
+        if input_key in ('raw', 'pipeline_raw'):
+            games = size
+        else:
+            if merged_games is None:
+                merged_games = count_games(work['merge'])
+            games = merged_games
+        input_bytes = directory_size(work[input_key])
+
+        result = measure_stage(function, work)
+        result.update({
+            'stage': name,
+            'size': size,
+            'games': games,
+            'input_bytes': input_bytes
+        })
+        if 'seconds' in result:
+            seconds = max(result['seconds'], 1e-9)
+            result['games_per_sec'] = games / seconds
+            result['mb_per_sec'] = input_bytes / (1 << 20) / seconds
+            print(f"{name:<26} {games:>7} 局  {result['seconds']:8.2f} s  "
+                  f"{result['games_per_sec']:10.1f} games/s  "
+                  f"{result['mb_per_sec']:8.2f} MB/s  "
+                  f"峰值内存 {result['peak_rss_mb']} MB")
+        else:
+            print(f"{name:<26} {games:>7} 局  出错: {result['error']}")
+        results.append(result)
+
+    shutil.rmtree(work_directory, ignore_errors=True)
+    return results
+
+
+def run_benchmark(output_directory,
+                  sizes=(200, 1000, 5000),
+                  seed=SYNTHETIC_SEED,
+                  stage_names=None,
+                  results_path=None):
+    os.makedirs(output_directory, exist_ok=True)
+    results = []
+    for size in sizes:
+        results.extend(
+            benchmark_size(output_directory, size, seed, stage_names))
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'sizes': list(sizes),
+        'results': results,
+    }
+    if results_path is None:
+        results_path = os.path.join(
+            output_directory,
+            f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {results_path}")
+    return report
+
+
+if __name__ == "__main__":
+    output_directory = r"E:\VSCPython\Amazons\benchmark"
+    run_benchmark(output_directory)
@@ -1,59 +1,118 @@
 import os
-import json
 import re
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from manifest import Manifest, call_stage
+from json_stream import (iter_json_objects, rewrite_json_array, is_shard,
+                         open_shard, is_empty_shard)
+from metrics import current_metrics, run_task
+
+# 乱码判定与原先对 json.dumps 结果的正则一致：孤立代理项以及 BMP 以外的码位
+INVALID_CHAR = re.compile(r'[^\u0000-\uD7FF\uE000-\uFFFF]')
+# 原始 JSON 文本中，上述码位还可能以 \uD800-\uDFFF 转义的形式出现
+INVALID_TEXT = re.compile(r'[^\u0000-\uD7FF\uE000-\uFFFF]'
+                          r'|(?<!\\)(?:\\\\)*\\u[dD][89a-fA-F][0-9a-fA-F]{2}')
 
 
 def is_valid_json(obj):
-    # 检查对象中是否包含乱码字符（例如 �）
-    obj_str = json.dumps(obj, ensure_ascii=False)
-    return not re.search(r'[^\u0000-\uD7FF\uE000-\uFFFF]', obj_str)
+    # 检查对象中是否包含乱码字符（例如 �），直接遍历解码后的字符串，不再重新序列化
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if type(obj) is dict:
+            for key, value in obj.items():
+                if not key.isascii() and INVALID_CHAR.search(key):
+                    return False
+                stack.append(value)
+        elif type(obj) is list:
+            stack.extend(obj)
+        elif type(obj) is str:
+            if not obj.isascii() and INVALID_CHAR.search(obj):
+                return False
+    return True
+
+
+def is_valid_text(text):
+    return not INVALID_TEXT.search(text)
+
+
+def has_invalid_text(file_path):
+    # JSON 字符串中不会出现换行，转义序列不会跨行，可以逐行检查原始文本
+    current_metrics().add('bytes_read', os.path.getsize(file_path))
+    with open_shard(file_path) as file:
+        return any(INVALID_TEXT.search(line) for line in file)
 
 
 def compress_json_file(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
+        metrics = current_metrics()
 
-        valid_data = [obj for obj in data if is_valid_json(obj)]
+        def valid_texts():
+            for text in iter_json_objects(file_path, raw=True):
+                metrics.add('games_in')
+                if is_valid_text(text):
+                    metrics.add('games_kept')
+                    yield text
+                else:
+                    metrics.add('games_dropped')
 
-        if not valid_data:
+        if has_invalid_text(file_path):
+            valid_count = rewrite_json_array(file_path,
+                                             valid_texts(),
+                                             raw=True)
+        elif is_empty_shard(file_path):
+            valid_count = 0  # 空数组文件与原先一样删除
+        else:
+            return True
+
+        if not valid_count:
             os.remove(file_path)
             print(f"已删除空文件: {file_path}")
         else:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write('[\n')
-                for i, obj in enumerate(valid_data):
-                    if i > 0:
-                        file.write(',\n')
-                    json.dump(obj, file, ensure_ascii=False)
-                file.write('\n]')
             print(f"已处理文件: {file_path}")
+        return True
     except Exception as e:
         print(f"处理文件 {file_path} 时出错: {e}")
+        return False
 
 
-def process_directory(directory_path, max_workers=8):
+def process_directory(directory_path, max_workers=8, manifest_path=None):
     file_paths = []
     for root, dirs, files in os.walk(directory_path):
         for file in files:
-            if file.endswith('.json'):
+            if is_shard(file):
                 file_paths.append(os.path.join(root, file))
 
+    manifest = Manifest(manifest_path) if manifest_path else None
+    if manifest is not None:
+        file_paths = manifest.pending('compress_json', file_paths)
+
+    with_fingerprint = manifest is not None
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(compress_json_file, file_path)
-            for file_path in file_paths
-        ]
+        futures = {}
+        for file_path in file_paths:
+            future = executor.submit(run_task, 'compress_json', file_path,
+                                     call_stage, compress_json_file, file_path,
+                                     (), with_fingerprint)
+            futures[future] = file_path
         for future in tqdm(as_completed(futures), total=len(futures)):
             try:
-                future.result()
+                done, fingerprint = future.result()
+                if manifest is not None and fingerprint is not None and done:
+                    file_path = futures[future]
+                    manifest.record('compress_json', file_path, fingerprint,
+                                    [file_path])
             except Exception as e:
                 print(f"处理过程中出现错误: {e}")
 
+    if manifest is not None:
+        manifest.compact()
+
 
 if __name__ == "__main__":
     directory_path = r"E:\VSCPython\Amazons\dataset"
     max_workers = 8
-    process_directory(directory_path, max_workers=max_workers)
+    manifest_path = r"E:\VSCPython\Amazons\dataset\manifest.jsonl"
+    process_directory(directory_path,
+                      max_workers=max_workers,
+                      manifest_path=manifest_path)
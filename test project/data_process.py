@@ -1,10 +1,15 @@
 import os
-import json
 import csv
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
-from collections import defaultdict
+from multiprocessing import Lock, shared_memory
 from typing import Dict
+import numpy as np
 from tqdm import tqdm
+from json_stream import iter_json_objects, is_shard
+from json_backend import decode_game
+from game_store import GameStore, STORE_CHUNK_GAMES, is_game_store
+from manifest import Manifest, file_fingerprint
+from metrics import current_metrics, run_task
 
 
 class Coordinates:
@@ -31,6 +36,36 @@ class Action:
         self.barrier_y = barrier_y
 
 
+# Zobrist 哈希：每种棋子在每个格子上对应一个固定的 64 位随机数，局面哈希为各棋子随机数的异或，
+# 空格对应 0；行棋方由障碍数的奇偶决定，不单独编码
+ZOBRIST_SEED = 20240607
+
+
+def build_zobrist_keys():
+    keys = np.random.default_rng(ZOBRIST_SEED).integers(0,
+                                                        1 << 64,
+                                                        size=(3, 64),
+                                                        dtype=np.uint64)
+    return {
+        0: (0, ) * 64,
+        1: tuple(keys[0].tolist()),
+        -1: tuple(keys[1].tolist()),
+        2: tuple(keys[2].tolist())
+    }
+
+
+ZOBRIST_KEYS = build_zobrist_keys()
+
+
+def board_hash(chessboard):
+    # 从头计算局面哈希，用于校验增量更新的结果
+    value = 0
+    for x in range(8):
+        for y in range(8):
+            value ^= ZOBRIST_KEYS[chessboard.get_piece(x, y)][x * 8 + y]
+    return value
+
+
 class Board:
 
     def __init__(self):
@@ -44,6 +79,7 @@ class Board:
         self.chessboard[2][7] = -1
         self.chessboard[5][7] = -1
         self.chessboard[7][5] = -1
+        self.hash = board_hash(self)
 
     @staticmethod
     def is_valid_map(x, y):
@@ -55,28 +91,44 @@ class Board:
     def can_do(self, nx, ny):
         return self.is_valid_map(nx, ny) and self.chessboard[nx][ny] == 0
 
+    def update_hash(self, x, y, value):
+        # 在格子 (x, y) 改为 value 之前调用，增量更新局面哈希
+        keys = ZOBRIST_KEYS
+        square = x * 8 + y
+        self.hash ^= keys[self.chessboard[x][y]][square] ^ keys[value][square]
+
     def move_piece(self, x, y, nx, ny):
+        self.update_hash(nx, ny, self.chessboard[x][y])
+        self.update_hash(x, y, 0)
         self.chessboard[nx][ny] = self.chessboard[x][y]
         self.chessboard[x][y] = 0
 
     def place_block(self, x, y):
+        self.update_hash(x, y, 2)
         self.chessboard[x][y] = 2
 
     def clear(self, x, y):
         self.temp = self.chessboard[x][y]
+        self.update_hash(x, y, 0)
         self.chessboard[x][y] = 0
 
     def restore(self, x, y, nx, ny, bx, by):
         if nx == -1:
+            self.update_hash(x, y, self.temp)
             self.chessboard[x][y] = self.temp
             self.temp = 0
         else:
             if x == bx and y == by:
+                self.update_hash(x, y, self.chessboard[nx][ny])
                 self.chessboard[x][y] = self.chessboard[nx][ny]
+                self.update_hash(nx, ny, 0)
                 self.chessboard[nx][ny] = 0
             else:
+                self.update_hash(x, y, self.chessboard[nx][ny])
                 self.chessboard[x][y] = self.chessboard[nx][ny]
+                self.update_hash(nx, ny, 0)
                 self.chessboard[nx][ny] = 0
+                self.update_hash(bx, by, 0)
                 self.chessboard[bx][by] = 0
 
 
@@ -118,19 +170,394 @@ def expand_move(chessboard, player):
     return legal_moves
 
 
+# 位棋盘：第 x 行第 y 列对应第 x * 8 + y 位，方向顺序与 expand_move 相同
+DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0),
+              (1, 1))
+DIRECTION_STEPS = tuple(dx * 8 + dy for dx, dy in DIRECTIONS)
+
+
+def build_ray_tables():
+    ray_squares = []
+    ray_masks = []
+    for square in range(64):
+        x, y = divmod(square, 8)
+        squares_by_direction = []
+        masks_by_direction = []
+        for dx, dy in DIRECTIONS:
+            squares = []
+            nx, ny = x + dx, y + dy
+            while 0 <= nx < 8 and 0 <= ny < 8:
+                squares.append(nx * 8 + ny)
+                nx += dx
+                ny += dy
+            mask = 0
+            for s in squares:
+                mask |= 1 << s
+            squares_by_direction.append(tuple(squares))
+            masks_by_direction.append(mask)
+        ray_squares.append(tuple(squares_by_direction))
+        ray_masks.append(tuple(masks_by_direction))
+    return tuple(ray_squares), tuple(ray_masks)
+
+
+RAY_SQUARES, RAY_MASKS = build_ray_tables()
+SQUARE_COORDS = tuple(divmod(square, 8) for square in range(64))
+
+
+def queen_squares(square, occupied):
+    # 按 expand_move 的遍历顺序返回从 square 出发可到达的空格
+    result = []
+    rays = RAY_SQUARES[square]
+    masks = RAY_MASKS[square]
+    for d in range(8):
+        blockers = masks[d] & occupied
+        if not blockers:
+            result.extend(rays[d])
+            continue
+        step = DIRECTION_STEPS[d]
+        if step > 0:
+            first = (blockers & -blockers).bit_length() - 1
+            length = (first - square) // step - 1
+        else:
+            first = blockers.bit_length() - 1
+            length = (square - first) // -step - 1
+        if length:
+            result.extend(rays[d][:length])
+    return result
+
+
+def queen_mask(square, occupied):
+    reach = 0
+    masks = RAY_MASKS[square]
+    for d in range(8):
+        ray = masks[d]
+        blockers = ray & occupied
+        if blockers:
+            if DIRECTION_STEPS[d] > 0:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAY_MASKS[first][d] | (1 << first)
+        reach |= ray
+    return reach
+
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BitBoard:
+
+    def __init__(self):
+        self.black = (1 << 2) | (1 << 16) | (1 << 40) | (1 << 58)
+        self.white = (1 << 5) | (1 << 23) | (1 << 47) | (1 << 61)
+        self.arrows = 0
+        self.temp = 0
+        self.hash = board_hash(self)
+
+    @classmethod
+    def from_board(cls, board):
+        bitboard = cls()
+        bitboard.black = bitboard.white = bitboard.arrows = 0
+        bitboard.hash = 0
+        for x in range(8):
+            for y in range(8):
+                bitboard.set_piece(x, y, board.get_piece(x, y))
+        return bitboard
+
+    def to_board(self):
+        board = Board()
+        board.chessboard = self.chessboard
+        board.hash = self.hash
+        return board
+
+    @property
+    def chessboard(self):
+        return [[self.get_piece(x, y) for y in range(8)] for x in range(8)]
+
+    @property
+    def occupied(self):
+        return self.black | self.white | self.arrows
+
+    def pieces(self, player):
+        return self.black if player == 1 else self.white
+
+    @staticmethod
+    def is_valid_map(x, y):
+        return 0 <= x < 8 and 0 <= y < 8
+
+    def get_piece(self, x, y):
+        bit = 1 << (x * 8 + y)
+        if self.black & bit:
+            return 1
+        if self.white & bit:
+            return -1
+        if self.arrows & bit:
+            return 2
+        return 0
+
+    def set_piece(self, x, y, value):
+        square = x * 8 + y
+        self.hash ^= ZOBRIST_KEYS[self.get_piece(x, y)][square]
+        self.hash ^= ZOBRIST_KEYS[value][square]
+        bit = 1 << square
+        self.black &= ~bit
+        self.white &= ~bit
+        self.arrows &= ~bit
+        if value == 1:
+            self.black |= bit
+        elif value == -1:
+            self.white |= bit
+        elif value == 2:
+            self.arrows |= bit
+
+    def can_do(self, nx, ny):
+        if not self.is_valid_map(nx, ny):
+            return False
+        return not self.occupied & (1 << (nx * 8 + ny))
+
+    def move_piece(self, x, y, nx, ny):
+        self.set_piece(nx, ny, self.get_piece(x, y))
+        self.set_piece(x, y, 0)
+
+    def place_block(self, x, y):
+        self.set_piece(x, y, 2)
+
+    def clear(self, x, y):
+        self.temp = self.get_piece(x, y)
+        self.set_piece(x, y, 0)
+
+    def restore(self, x, y, nx, ny, bx, by):
+        if nx == -1:
+            self.set_piece(x, y, self.temp)
+            self.temp = 0
+        else:
+            self.set_piece(x, y, self.get_piece(nx, ny))
+            self.set_piece(nx, ny, 0)
+            if x != bx or y != by:
+                self.set_piece(bx, by, 0)
+
+
+def expand_move_bitboard(chessboard: BitBoard, player):
+    # 与 expand_move 顺序一致，逐个产生 (x0, y0, x1, y1, x2, y2) 元组
+    occupied = chessboard.occupied
+    for square in iter_bits(chessboard.pieces(player)):
+        origin = SQUARE_COORDS[square]
+        vacated = occupied ^ (1 << square)
+        for target in queen_squares(square, vacated):
+            prefix = origin + SQUARE_COORDS[target]
+            for block in queen_squares(target, vacated):
+                yield prefix + SQUARE_COORDS[block]
+
+
+def count_moves_bitboard(chessboard: BitBoard, player):
+    occupied = chessboard.occupied
+    count = 0
+    for square in iter_bits(chessboard.pieces(player)):
+        vacated = occupied ^ (1 << square)
+        for target in iter_bits(queen_mask(square, vacated)):
+            count += bin(queen_mask(target, vacated)).count('1')
+    return count
+
+
+def is_queen_path(chessboard, x, y, nx, ny):
+    dx, dy = nx - x, ny - y
+    if dx == dy == 0 or (dx != 0 and dy != 0 and abs(dx) != abs(dy)):
+        return False
+    step_x = (dx > 0) - (dx < 0)
+    step_y = (dy > 0) - (dy < 0)
+    while x != nx or y != ny:
+        x += step_x
+        y += step_y
+        if not chessboard.can_do(x, y):
+            return False
+    return True
+
+
+def is_legal_move(chessboard, move: Action, player):
+    # 只沿着法经过的两条射线检查，不生成全部合法着法；Board 与 BitBoard 均可使用
+    if not chessboard.is_valid_map(move.start_x, move.start_y):
+        return False
+    if chessboard.get_piece(move.start_x, move.start_y) != player:
+        return False
+    if not is_queen_path(chessboard, move.start_x, move.start_y, move.end_x,
+                         move.end_y):
+        return False
+    chessboard.clear(move.start_x, move.start_y)
+    legal = is_queen_path(chessboard, move.end_x, move.end_y, move.barrier_x,
+                          move.barrier_y)
+    chessboard.restore(move.start_x, move.start_y, -1, -1, -1, -1)
+    return legal
+
+
+def find_illegal_ply(moves):
+    # 用列表棋盘复盘一局，返回第一步非法着法所在的步数，全部合法时返回 -1；
+    # 位棋盘每步都要重算哈希，复盘反而更慢
+    chessboard = Board()
+    for i, coords in enumerate(moves):
+        move = Action(*coords)
+        if not is_legal_move(chessboard, move, 1 if i % 2 == 0 else -1):
+            return i
+        chessboard.move_piece(move.start_x, move.start_y, move.end_x,
+                              move.end_y)
+        chessboard.place_block(move.barrier_x, move.barrier_y)
+    return -1
+
+
 def serialize_move(move: Action) -> str:
     return f'{move.start_x},{move.start_y},{move.end_x},{move.end_y},{move.barrier_x},{move.barrier_y}'
 
 
-def calculate_probabilities(frequencies: Dict[str, int],
-                            probabilities: Dict[str, float]):
+# 着法编号：六个 3 位坐标依次打包成 18 位整数，编号顺序与 serialize_move 的字符串顺序一致
+MOVE_ID_BITS = 18
+NUM_MOVE_IDS = 1 << MOVE_ID_BITS
+COLORS = ('black', 'white')
+PHASES = ('opening', 'middle', 'end')
+PHASE_CUTOFFS = (12, 44)
+COUNTER_DTYPE = np.int32
+
+
+def encode_move(move: Action) -> int:
+    return (move.start_x << 15 | move.start_y << 12 | move.end_x << 9
+            | move.end_y << 6 | move.barrier_x << 3 | move.barrier_y)
+
+
+def decode_move(move_id: int) -> Action:
+    return Action(move_id >> 15 & 7, move_id >> 12 & 7, move_id >> 9 & 7,
+                  move_id >> 6 & 7, move_id >> 3 & 7, move_id & 7)
+
+
+def move_id_to_str(move_id: int) -> str:
+    return serialize_move(decode_move(move_id))
+
+
+def game_phase(i):
+    if i < PHASE_CUTOFFS[0]:
+        return 0
+    elif i < PHASE_CUTOFFS[1]:
+        return 1
+    return 2
+
+
+# 棋盘的八种二面体变换，以格子编号 x * 8 + y 的置换表示，第 0 个为恒等变换
+SYMMETRY_SQUARES = tuple(
+    tuple(a * 8 + b for a, b in (transform(x, y) for x, y in SQUARE_COORDS))
+    for transform in (lambda x, y: (x, y), lambda x, y: (7 - x, y),
+                      lambda x, y: (x, 7 - y), lambda x, y: (7 - x, 7 - y),
+                      lambda x, y: (y, x), lambda x, y: (7 - y, 7 - x),
+                      lambda x, y: (y, 7 - x), lambda x, y: (7 - y, x)))
+
+
+def board_symmetries(chessboard):
+    # 返回使局面保持不变的变换下标，初始局面只有恒等变换和 x -> 7 - x 翻转
+    return tuple(k for k, squares in enumerate(SYMMETRY_SQUARES) if all(
+        chessboard.get_piece(
+            *SQUARE_COORDS[squares[s]]) == chessboard.get_piece(
+                *SQUARE_COORDS[s]) for s in range(64)))
+
+
+def transform_move_id(move_id, squares):
+    return (squares[move_id >> 12] << 12 | squares[move_id >> 6 & 63] << 6
+            | squares[move_id & 63])
+
+
+INITIAL_SYMMETRIES = board_symmetries(Board())
+
+
+class SymmetryTracker:
+    # 把一局棋整体变换到规范朝向：每一步在尚未被打破的对称变换中选使着法编号最小的一个，
+    # 并与之前选定的变换复合；着法的起点、终点和障碍都是某变换的不动点时该变换才继续保留
+
+    def __init__(self, symmetries=INITIAL_SYMMETRIES):
+        self.symmetries = symmetries
+        self.transform = SYMMETRY_SQUARES[0]
+
+    def canonical(self, move_id):
+        move_id = transform_move_id(move_id, self.transform)
+        if len(self.symmetries) == 1:
+            return move_id
+        best = min(
+            self.symmetries,
+            key=lambda k: transform_move_id(move_id, SYMMETRY_SQUARES[k]))
+        squares = SYMMETRY_SQUARES[best]
+        move_id = transform_move_id(move_id, squares)
+        self.transform = tuple(squares[s] for s in self.transform)
+        fixed = (move_id >> 12, move_id >> 6 & 63, move_id & 63)
+        self.symmetries = tuple(k for k in self.symmetries if all(
+            SYMMETRY_SQUARES[k][s] == s for s in fixed))
+        return move_id
+
+
+def canonicalize_move_ids(move_ids, lengths, symmetries=INITIAL_SYMMETRIES):
+    canonical_ids = []
+    move_ids = np.asarray(move_ids).tolist()
+    start = 0
+    for length in np.asarray(lengths).tolist():
+        tracker = SymmetryTracker(symmetries)
+        canonical_ids.extend(
+            tracker.canonical(move_id)
+            for move_id in move_ids[start:start + length])
+        start += length
+    return np.array(canonical_ids, dtype=np.int64)
+
+
+def expand_symmetric_counters(data, symmetries=INITIAL_SYMMETRIES):
+    # 把规范化统计展开回具体着法：每个着法取其在各对称变换下的像的计数平均值，
+    # 结果为浮点数组，总数与胜率均与展开前一致
+    move_ids = np.arange(NUM_MOVE_IDS)
+    expanded = {}
+    for key, counts in data.items():
+        total = np.zeros(counts.shape, dtype=np.float64)
+        for k in symmetries:
+            squares = np.array(SYMMETRY_SQUARES[k])
+            total += counts[..., transform_move_id(move_ids, squares)]
+        expanded[key] = total / len(symmetries)
+    return expanded
+
+
+def new_counters():
+    # 计数数组按 (颜色, 阶段, 着法编号) 索引；着法频率与对局数的统计口径相同，共用 games
+    shape = (len(COLORS), len(PHASES), NUM_MOVE_IDS)
+    return {
+        'games': np.zeros(shape, dtype=COUNTER_DTYPE),
+        'win_games': np.zeros(shape, dtype=COUNTER_DTYPE),
+    }
+
+
+def add_counts(local_data, key, indices):
+    counts = local_data[key].reshape(-1)
+    counts += np.bincount(np.asarray(indices, dtype=np.int64),
+                          minlength=counts.size).astype(COUNTER_DTYPE)
+
+
+def counts_to_dict(counts) -> Dict[int, int]:
+    move_ids = np.flatnonzero(counts)
+    return dict(zip(move_ids.tolist(), counts[move_ids].tolist()))
+
+
+def get_counts(data, table, color, phase=None) -> Dict[int, int]:
+    # table 为 'move_frequencies'、'games' 或 'win_games'，phase 为 None 时统计全部阶段
+    counts = data['win_games' if table == 'win_games' else 'games']
+    counts = counts[COLORS.index(color)]
+    if phase is None:
+        counts = counts.sum(axis=0)
+    else:
+        counts = counts[PHASES.index(phase)]
+    return counts_to_dict(counts)
+
+
+def calculate_probabilities(frequencies: Dict[int, int],
+                            probabilities: Dict[int, float]):
     total_moves = sum(frequencies.values())
     for move, count in frequencies.items():
         probabilities[move] = count / total_moves
 
 
-def calculate_win_rate(games: Dict[str, int], win_games: Dict[str, int],
-                       win_rate: Dict[str, Dict[str, float]]):
+def calculate_win_rate(games: Dict[int, int], win_games: Dict[int, int],
+                       win_rate: Dict[int, Dict[str, float]]):
     for move, count in win_games.items():
         total_games = games.get(move, 0)
         if total_games > 0:
@@ -141,123 +568,174 @@ def calculate_win_rate(games: Dict[str, int], win_games: Dict[str, int],
             }
 
 
-def write_moves_to_csv(move_probabilities: Dict[str, float], filename: str):
+def write_moves_to_csv(move_probabilities: Dict[int, float], filename: str):
     with open(filename, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Move", "Probability"])
         for move, probability in sorted(move_probabilities.items()):
             if probability != 0.0:
-                writer.writerow([move, probability])
+                writer.writerow([move_id_to_str(move), probability])
 
 
-def write_win_rate_to_csv(win_rate: Dict[str, Dict[str, float]],
+def write_win_rate_to_csv(win_rate: Dict[int, Dict[str, float]],
                           filename: str):
     with open(filename, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Move", "Count", "TotalGames", "WinRate"])
         for move, stats in sorted(win_rate.items()):
             writer.writerow([
-                move, stats['count'], stats['total_games'], stats['win_rate']
+                move_id_to_str(move), stats['count'], stats['total_games'],
+                stats['win_rate']
             ])
 
 
-def process_file(file_path: str):
-    with open(file_path, 'r') as file:
-        match_data = json.load(file)
-
-    local_data = {
-        'black_move_frequencies': defaultdict(int),
-        'white_move_frequencies': defaultdict(int),
-        'black_move_frequencies_opening': defaultdict(int),
-        'white_move_frequencies_opening': defaultdict(int),
-        'black_move_frequencies_middle': defaultdict(int),
-        'white_move_frequencies_middle': defaultdict(int),
-        'black_move_frequencies_end': defaultdict(int),
-        'white_move_frequencies_end': defaultdict(int),
-        'black_win_games': defaultdict(int),
-        'white_win_games': defaultdict(int),
-        'black_win_games_opening': defaultdict(int),
-        'white_win_games_opening': defaultdict(int),
-        'black_win_games_middle': defaultdict(int),
-        'white_win_games_middle': defaultdict(int),
-        'black_win_games_end': defaultdict(int),
-        'white_win_games_end': defaultdict(int),
-        'black_games': defaultdict(int),
-        'white_games': defaultdict(int),
-        'black_games_opening': defaultdict(int),
-        'white_games_opening': defaultdict(int),
-        'black_games_middle': defaultdict(int),
-        'white_games_middle': defaultdict(int),
-        'black_games_end': defaultdict(int),
-        'white_games_end': defaultdict(int),
-    }
+def process_file(file_path: str, validate=False, canonical=False):
+    if is_game_store(file_path):
+        return process_game_store(file_path, canonical=canonical)
 
-    for obj in match_data:
+    local_data = new_counters()
+    game_indices = []
+    win_indices = []
+    invalid_games = 0
+    games_in = 0
+
+    for game in iter_json_objects(file_path, decode=decode_game):
+        games_in += 1
         chessboard = Board()
-        steps = len(obj["log"])
-        winner = 0 if obj["scores"][0] == 2 else 1
-        for i in range(steps - 1):
-            response = obj["log"][i][str(i % 2)]["response"]
-            move = Action(response["x0"], response["y0"], response["x1"],
-                          response["y1"], response["x2"], response["y2"])
-
-            if i < 12:
-                current_frequencies = local_data[
-                    'black_move_frequencies_opening'] if i % 2 == 0 else local_data[
-                        'white_move_frequencies_opening']
-                current_games = local_data[
-                    'black_games_opening'] if i % 2 == 0 else local_data[
-                        'white_games_opening']
-                current_win_games = local_data[
-                    'black_win_games_opening'] if winner == 0 else local_data[
-                        'white_win_games_opening']
-            elif i < 44:
-                current_frequencies = local_data[
-                    'black_move_frequencies_middle'] if i % 2 == 0 else local_data[
-                        'white_move_frequencies_middle']
-                current_games = local_data[
-                    'black_games_middle'] if i % 2 == 0 else local_data[
-                        'white_games_middle']
-                current_win_games = local_data[
-                    'black_win_games_middle'] if winner == 0 else local_data[
-                        'white_win_games_middle']
+        winner = game.winner
+        game_start = len(game_indices)
+        win_start = len(win_indices)
+        tracker = SymmetryTracker() if canonical else None
+        for i, coords in enumerate(game.moves):
+            move = Action(*coords)
+
+            color = i % 2
+            if validate and not is_legal_move(chessboard, move,
+                                              1 if color == 0 else -1):
+                # 出现非法着法说明对局记录损坏或不同步，整局丢弃
+                del game_indices[game_start:]
+                del win_indices[win_start:]
+                invalid_games += 1
+                break
+
+            index = (color * len(PHASES) + game_phase(i)) << MOVE_ID_BITS
+            if tracker is None:
+                index |= encode_move(move)
             else:
-                current_frequencies = local_data[
-                    'black_move_frequencies_end'] if i % 2 == 0 else local_data[
-                        'white_move_frequencies_end']
-                current_games = local_data[
-                    'black_games_end'] if i % 2 == 0 else local_data[
-                        'white_games_end']
-                current_win_games = local_data[
-                    'black_win_games_end'] if winner == 0 else local_data[
-                        'white_win_games_end']
-
-            move_str = serialize_move(move)
-            current_frequencies[move_str] += 1
-            current_games[move_str] += 1
-            if i % 2 == winner:
-                current_win_games[move_str] += 1
-
-            overall_frequencies = local_data[
-                'black_move_frequencies'] if i % 2 == 0 else local_data[
-                    'white_move_frequencies']
-            overall_games = local_data[
-                'black_games'] if i % 2 == 0 else local_data['white_games']
-            overall_win_games = local_data[
-                'black_win_games'] if winner == 0 else local_data[
-                    'white_win_games']
-            overall_frequencies[move_str] += 1
-            overall_games[move_str] += 1
-            if i % 2 == winner:
-                overall_win_games[move_str] += 1
+                index |= tracker.canonical(encode_move(move))
+            game_indices.append(index)
+            if color == winner:
+                win_indices.append(index)
 
             chessboard.move_piece(move.start_x, move.start_y, move.end_x,
                                   move.end_y)
             chessboard.place_block(move.barrier_x, move.barrier_y)
 
+    if invalid_games:
+        print(f"文件 {file_path} 中有 {invalid_games} 局对局含非法着法，已跳过")
+    metrics = current_metrics()
+    metrics.add('games_in', games_in)
+    metrics.add('games_kept', games_in - invalid_games)
+    metrics.add('games_dropped', invalid_games)
+    add_counts(local_data, 'games', game_indices)
+    add_counts(local_data, 'win_games', win_indices)
+    return local_data
+
+
+def extract_game_arrays(match_data, file_path, canonical=False):
+    coords = []
+    lengths = []
+    game_winners = []
+    for game in match_data:
+        coords.extend(game.moves)
+        lengths.append(len(game.moves))
+        game_winners.append(game.winner)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 6)
+    game_winners = np.asarray(game_winners, dtype=np.int64)
+    # 坐标越界时打包出的着法编号会串到相邻的下标，含越界坐标的对局整局丢弃
+    game_ids = np.repeat(np.arange(len(lengths)), lengths)
+    invalid = np.zeros(len(lengths), dtype=bool)
+    invalid[game_ids[((coords < 0) | (coords >= 8)).any(axis=1)]] = True
+    invalid_games = int(invalid.sum())
+    if invalid_games:
+        coords = coords[~invalid[game_ids]]
+        lengths = lengths[~invalid]
+        game_winners = game_winners[~invalid]
+        print(f"文件 {file_path} 中有 {invalid_games} 局对局坐标越界，已跳过")
+    metrics = current_metrics()
+    metrics.add('games_in', len(invalid))
+    metrics.add('games_kept', len(invalid) - invalid_games)
+    metrics.add('games_dropped', invalid_games)
+    return move_arrays(coords, lengths, game_winners, canonical)
+
+
+def extract_store_arrays(store: GameStore,
+                         start=0,
+                         stop=None,
+                         canonical=False):
+    stop = len(store) if stop is None else min(stop, len(store))
+    offsets = np.asarray(store.offsets[start:stop + 1])
+    coords = store.moves[offsets[0]:offsets[-1]]
+    return move_arrays(coords, np.diff(offsets), store.winners[start:stop],
+                       canonical)
+
+
+def move_arrays(coords, lengths, game_winners, canonical=False):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 6)
+    move_ids = (coords << np.array([15, 12, 9, 6, 3, 0])).sum(axis=1)
+    if canonical:
+        move_ids = canonicalize_move_ids(move_ids, lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    plies = np.arange(len(move_ids), dtype=np.int64) - starts
+    colors = plies % 2
+    winners = np.repeat(np.asarray(game_winners, dtype=np.int64), lengths)
+    return move_ids, plies, colors, winners
+
+
+def aggregate_game_arrays(move_ids, plies, colors, winners):
+    phases = np.searchsorted(PHASE_CUTOFFS, plies, side='right')
+    indices = (colors * len(PHASES) + phases) << MOVE_ID_BITS | move_ids
+    local_data = new_counters()
+    add_counts(local_data, 'games', indices)
+    add_counts(local_data, 'win_games', indices[colors == winners])
     return local_data
 
 
+def process_game_store(store_path: str, start=0, stop=None, canonical=False):
+    store = GameStore(store_path)
+    return aggregate_game_arrays(
+        *extract_store_arrays(store, start, stop, canonical))
+
+
+def drop_illegal_games(match_data, file_path):
+    invalid_games = 0
+    for game in match_data:
+        if find_illegal_ply(game.moves) < 0:
+            yield game
+        else:
+            invalid_games += 1
+    # 通过校验的对局在 extract_game_arrays 中计数
+    metrics = current_metrics()
+    metrics.add('games_in', invalid_games)
+    metrics.add('games_dropped', invalid_games)
+    if invalid_games:
+        print(f"文件 {file_path} 中有 {invalid_games} 局对局含非法着法，已跳过")
+
+
+def process_file_batch(file_path: str, validate=False, canonical=False):
+    # 批量模式：不逐步复盘，直接把整份文件的着法展开成数组后用 bincount 统计
+    if is_game_store(file_path):
+        return process_game_store(file_path, canonical=canonical)
+
+    match_data = iter_json_objects(file_path, decode=decode_game)
+    if validate:
+        match_data = drop_illegal_games(match_data, file_path)
+    return aggregate_game_arrays(
+        *extract_game_arrays(match_data, file_path, canonical))
+
+
 def merge_dictionaries(target: Dict, source: Dict):
     for key, value in source.items():
         if key in target:
@@ -266,165 +744,237 @@ def merge_dictionaries(target: Dict, source: Dict):
             target[key] = value
 
 
-all_files_data = {
-    'black_move_frequencies': defaultdict(int),
-    'white_move_frequencies': defaultdict(int),
-    'black_move_frequencies_opening': defaultdict(int),
-    'white_move_frequencies_opening': defaultdict(int),
-    'black_move_frequencies_middle': defaultdict(int),
-    'white_move_frequencies_middle': defaultdict(int),
-    'black_move_frequencies_end': defaultdict(int),
-    'white_move_frequencies_end': defaultdict(int),
-    'black_win_games': defaultdict(int),
-    'white_win_games': defaultdict(int),
-    'black_win_games_opening': defaultdict(int),
-    'white_win_games_opening': defaultdict(int),
-    'black_win_games_middle': defaultdict(int),
-    'white_win_games_middle': defaultdict(int),
-    'black_win_games_end': defaultdict(int),
-    'white_win_games_end': defaultdict(int),
-    'black_games': defaultdict(int),
-    'white_games': defaultdict(int),
-    'black_games_opening': defaultdict(int),
-    'white_games_opening': defaultdict(int),
-    'black_games_middle': defaultdict(int),
-    'white_games_middle': defaultdict(int),
-    'black_games_end': defaultdict(int),
-    'white_games_end': defaultdict(int),
-}
-
-
-def process_directory():
-    directory_path = r"E:\VSCPython\Amazons\dataset\merge"
-
-    json_files = [
-        os.path.join(directory_path, file)
-        for file in os.listdir(directory_path) if file.endswith('.json')
-    ]
+def cache_file_path(cache_directory,
+                    content_hash,
+                    validate=False,
+                    canonical=False):
+    cutoffs = '_'.join(str(cutoff) for cutoff in PHASE_CUTOFFS)
+    suffix = ('_valid' if validate else '') + ('_canonical'
+                                               if canonical else '')
+    return os.path.join(cache_directory,
+                        f"{content_hash}_{cutoffs}{suffix}.npz")
+
+
+def save_counters(local_data, cache_path):
+    # 缓存只保存非零项，合并时按下标累加
+    games = local_data['games'].reshape(-1)
+    indices = np.flatnonzero(games)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file,
+                 indices=indices,
+                 games=games[indices],
+                 win_games=local_data['win_games'].reshape(-1)[indices])
+    os.replace(temp_path, cache_path)
+
+
+def add_cached_counters(target, cache_path):
+    with np.load(cache_path) as cached:
+        indices = cached['indices']
+        for key in ('games', 'win_games'):
+            target[key].reshape(-1)[indices] += cached[key]
+
+
+def cache_file(file_path,
+               cache_directory,
+               batch=False,
+               validate=False,
+               canonical=False):
+    # 按文件内容哈希缓存单个文件的统计结果，内容不变时不再重复统计
+    fingerprint = file_fingerprint(file_path)
+    cache_path = cache_file_path(cache_directory, fingerprint['hash'],
+                                 validate, canonical)
+    if not os.path.exists(cache_path):
+        if batch:
+            save_counters(process_file_batch(file_path, validate, canonical),
+                          cache_path)
+        else:
+            save_counters(process_file(file_path, validate, canonical),
+                          cache_path)
+    return fingerprint, cache_path
+
+
+def process_files(file_paths, batch=False, validate=False, canonical=False):
+    local_data = new_counters()
+    for file_path in file_paths:
+        if batch:
+            merge_dictionaries(
+                local_data, process_file_batch(file_path, validate, canonical))
+        else:
+            merge_dictionaries(local_data,
+                               process_file(file_path, validate, canonical))
+    return local_data
+
+
+def counters_from_buffer(buffer):
+    shape = (len(COLORS), len(PHASES), NUM_MOVE_IDS)
+    size = len(COLORS) * len(PHASES) * NUM_MOVE_IDS
+    itemsize = np.dtype(COUNTER_DTYPE).itemsize
+    return {
+        key:
+        np.ndarray(shape,
+                   dtype=COUNTER_DTYPE,
+                   buffer=buffer,
+                   offset=i * size * itemsize)
+        for i, key in enumerate(('games', 'win_games'))
+    }
 
-    max_processes = 8
 
-    with ProcessPoolExecutor(max_workers=max_processes) as process_executor:
-        futures = {
-            process_executor.submit(process_file, file): file
-            for file in json_files
-        }
+def add_sparse_counters(target, source):
+    indices = np.flatnonzero(source['games'])
+    for key in ('games', 'win_games'):
+        target[key].reshape(-1)[indices] += source[key].reshape(-1)[indices]
+
+
+shared_counters = None
+shared_lock = None
+shared_block = None
+
+
+def attach_shared_counters(block_name, lock):
+    global shared_counters, shared_lock, shared_block
+    shared_block = shared_memory.SharedMemory(name=block_name)
+    shared_counters = counters_from_buffer(shared_block.buf)
+    shared_lock = lock
+
+
+def accumulate_shared(func, *args):
+    # 工作进程先在本地统计一整批数据，再在锁内把非零项累加到共享内存的计数数组中，
+    # 结果不再经由管道回传给主进程
+    local_data = func(*args)
+    with shared_lock:
+        add_sparse_counters(shared_counters, local_data)
+
+
+all_files_data = new_counters()
+TASKS_PER_PROCESS = 4
+
+
+def process_directory(batch=False,
+                      directory_path=r"E:\VSCPython\Amazons\dataset\merge",
+                      cache_directory=None,
+                      manifest_path=None,
+                      validate=False,
+                      canonical=False):
+    max_processes = 8
+    manifest = Manifest(manifest_path) if manifest_path else None
+
+    if is_game_store(directory_path):
+        # 二进制对局库按对局区间分块，各进程直接内存映射读取
+        total_games = len(GameStore(directory_path))
+        tasks = [(accumulate_shared, process_game_store, directory_path, start,
+                  start + STORE_CHUNK_GAMES, canonical)
+                 for start in range(0, total_games, STORE_CHUNK_GAMES)]
+    else:
+        json_files = [
+            os.path.join(directory_path, file)
+            for file in os.listdir(directory_path) if is_shard(file)
+        ]
+        if cache_directory is None:
+            # 每个任务处理一批文件，批数取进程数的若干倍以便负载均衡
+            files_per_task = max(
+                1, -(-len(json_files) // (max_processes * TASKS_PER_PROCESS)))
+            tasks = [(accumulate_shared, process_files,
+                      json_files[start:start + files_per_task], batch,
+                      validate, canonical)
+                     for start in range(0, len(json_files), files_per_task)]
+        else:
+            # 清单中未变化的文件直接合并缓存，只有新增或改动的文件需要重新统计
+            os.makedirs(cache_directory, exist_ok=True)
+            tasks = []
+            for file in json_files:
+                record = None
+                if manifest is not None:
+                    record = manifest.lookup('data_process', file)
+                if record is not None and record['outputs'] == [
+                        os.path.abspath(
+                            cache_file_path(cache_directory, record['hash'],
+                                            validate, canonical))
+                ]:
+                    add_cached_counters(all_files_data, record['outputs'][0])
+                else:
+                    tasks.append((cache_file, file, cache_directory, batch,
+                                  validate, canonical))
+
+    block_size = sum(array.nbytes for array in all_files_data.values())
+    block = shared_memory.SharedMemory(create=True, size=block_size)
+    try:
+        # 整块清零用的临时视图立即释放；关闭共享内存前不能留有指向它的数组
+        np.ndarray(block_size, dtype=np.uint8, buffer=block.buf).fill(0)
+        block_counters = counters_from_buffer(block.buf)
+
+        with ProcessPoolExecutor(max_workers=max_processes,
+                                 initializer=attach_shared_counters,
+                                 initargs=(block.name,
+                                           Lock())) as process_executor:
+            futures = {
+                process_executor.submit(run_task, 'data_process', index, *task):
+                task
+                for index, task in enumerate(tasks)
+            }
 
-        for future in tqdm(as_completed(futures),
-                           total=len(futures),
-                           desc="Processing files"):
-            local_data = future.result()
-            for key in all_files_data.keys():
-                merge_dictionaries(all_files_data[key], local_data[key])
+            for future in tqdm(as_completed(futures),
+                               total=len(futures),
+                               desc="Processing files"):
+                task = futures[future]
+                if task[0] is not cache_file:
+                    future.result()
+                    continue
+                fingerprint, cache_path = future.result()
+                add_cached_counters(all_files_data, cache_path)
+                if manifest is not None:
+                    manifest.record('data_process', task[1], fingerprint,
+                                    [cache_path])
+
+        merge_dictionaries(all_files_data, block_counters)
+        del block_counters
+    finally:
+        block.close()
+        block.unlink()
+
+    if manifest is not None:
+        manifest.compact()
 
 
 if __name__ == "__main__":
-    process_directory()
-    black_move_probabilities_opening = {}
-    white_move_probabilities_opening = {}
-    black_move_probabilities_middle = {}
-    white_move_probabilities_middle = {}
-    black_move_probabilities_end = {}
-    white_move_probabilities_end = {}
-    black_move_probabilities = {}
-    white_move_probabilities = {}
-    black_win_rate_opening = {}
-    white_win_rate_opening = {}
-    black_win_rate_middle = {}
-    white_win_rate_middle = {}
-    black_win_rate_end = {}
-    white_win_rate_end = {}
-    black_win_rate = {}
-    white_win_rate = {}
-    '''
-    calculate_probabilities(all_files_data['black_move_frequencies_opening'],
-                            black_move_probabilities_opening)
-    calculate_probabilities(all_files_data['white_move_frequencies_opening'],
-                            white_move_probabilities_opening)
-    calculate_probabilities(all_files_data['black_move_frequencies_middle'],
-                            black_move_probabilities_middle)
-    calculate_probabilities(all_files_data['white_move_frequencies_middle'],
-                            white_move_probabilities_middle)
-    calculate_probabilities(all_files_data['black_move_frequencies_end'],
-                            black_move_probabilities_end)
-    calculate_probabilities(all_files_data['white_move_frequencies_end'],
-                            white_move_probabilities_end)
-    calculate_probabilities(all_files_data['black_move_frequencies'],
-                            black_move_probabilities)
-    calculate_probabilities(all_files_data['white_move_frequencies'],
-                            white_move_probabilities)
-    '''
-    calculate_win_rate(all_files_data['black_games_opening'],
-                       all_files_data['black_win_games_opening'],
-                       black_win_rate_opening)
-    calculate_win_rate(all_files_data['white_games_opening'],
-                       all_files_data['white_win_games_opening'],
-                       white_win_rate_opening)
-    calculate_win_rate(all_files_data['black_games_middle'],
-                       all_files_data['black_win_games_middle'],
-                       black_win_rate_middle)
-    calculate_win_rate(all_files_data['white_games_middle'],
-                       all_files_data['white_win_games_middle'],
-                       white_win_rate_middle)
-    calculate_win_rate(all_files_data['black_games_end'],
-                       all_files_data['black_win_games_end'],
-                       black_win_rate_end)
-    calculate_win_rate(all_files_data['white_games_end'],
-                       all_files_data['white_win_games_end'],
-                       white_win_rate_end)
-    calculate_win_rate(all_files_data['black_games'],
-                       all_files_data['black_win_games'], black_win_rate)
-    calculate_win_rate(all_files_data['white_games'],
-                       all_files_data['white_win_games'], white_win_rate)
-    '''
-    write_moves_to_csv(
-        black_move_probabilities_opening,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_moves_opening.csv")
-    write_moves_to_csv(
-        white_move_probabilities_opening,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_moves_opening.csv")
-    write_moves_to_csv(
-        black_move_probabilities_middle,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_moves_middle.csv")
-    write_moves_to_csv(
-        white_move_probabilities_middle,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_moves_middle.csv")
-    write_moves_to_csv(
-        black_move_probabilities_end,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_moves_end.csv")
-    write_moves_to_csv(
-        white_move_probabilities_end,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_moves_end.csv")
-    write_moves_to_csv(
-        black_move_probabilities,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_moves.csv")
-    write_moves_to_csv(
-        white_move_probabilities,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_moves.csv")
-    '''
-    write_win_rate_to_csv(
-        black_win_rate_opening,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_win_rate_opening.csv")
-    write_win_rate_to_csv(
-        white_win_rate_opening,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_win_rate_opening.csv")
-    write_win_rate_to_csv(
-        black_win_rate_middle,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_win_rate_middle.csv")
-    write_win_rate_to_csv(
-        white_win_rate_middle,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_win_rate_middle.csv")
-    write_win_rate_to_csv(
-        black_win_rate_end,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_win_rate_end.csv")
-    write_win_rate_to_csv(
-        white_win_rate_end,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_win_rate_end.csv")
-    write_win_rate_to_csv(
-        black_win_rate,
-        r"E:\VSCPython\Amazons\result_csv\black_chess_win_rate.csv")
-    write_win_rate_to_csv(
-        white_win_rate,
-        r"E:\VSCPython\Amazons\result_csv\white_chess_win_rate.csv")
+    process_directory(
+        batch=True,
+        cache_directory=r"E:\VSCPython\Amazons\dataset\cache",
+        manifest_path=r"E:\VSCPython\Amazons\dataset\manifest.jsonl")
+    output_directory = r"E:\VSCPython\Amazons\result_csv"
+    # 各颜色分阶段（phase 为 None 时为全部阶段）的着法概率和胜率，文件名与原先相同
+    for color in COLORS:
+        for phase in PHASES + (None, ):
+            suffix = f"_{phase}" if phase is not None else ""
+            move_probabilities = {}
+            calculate_probabilities(
+                get_counts(all_files_data, 'move_frequencies', color, phase),
+                move_probabilities)
+            write_moves_to_csv(
+                move_probabilities,
+                os.path.join(output_directory,
+                             f"{color}_chess_moves{suffix}.csv"))
+            win_rate = {}
+            calculate_win_rate(
+                get_counts(all_files_data, 'games', color, phase),
+                get_counts(all_files_data, 'win_games', color, phase),
+                win_rate)
+            write_win_rate_to_csv(
+                win_rate,
+                os.path.join(output_directory,
+                             f"{color}_chess_win_rate{suffix}.csv"))
+
+    # 其他统计口径（按 bot、对局长度等）另行由 aggregate 按 DEFAULT_REPORTS 统计，需要时打开；
+    # aggregate 依赖本模块，在这里导入以免循环导入
+    extra_reports = False
+    if extra_reports:
+        import aggregate
+        directory_path = r"E:\VSCPython\Amazons\dataset\merge"
+        tables = aggregate.process_directory(directory_path,
+                                             aggregate.DEFAULT_REPORTS)
+        for spec in aggregate.DEFAULT_REPORTS:
+            aggregate.write_report(
+                tables[spec.name], spec,
+                os.path.join(output_directory, f"{spec.name}.csv"))
 
     print("所有文件已处理完成。")
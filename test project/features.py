@@ -0,0 +1,185 @@
+import os
+import numpy as np
+from tqdm import tqdm
+from game_store import (GameStore, is_game_store, iter_json_games,
+                        iter_store_games)
+from data_process import (BitBoard, DIRECTIONS, DIRECTION_STEPS,
+                          count_moves_bitboard)
+from json_stream import is_shard
+from overlap import make_executor, load_result
+from metrics import run_task
+
+# 每个局面（第 ply 步走之前）的特征，与 (games, plies) 逐行对齐：
+#   mobility_*  双方的合法着法数，与 len(expand_move(...)) 相同
+#   queen_*     按皇后走法距离计算，己方比对方更近的空格数
+#   king_*      按王走法（一步一格）距离计算，己方比对方更近的空格数
+FEATURE_NAMES = ('mobility_black', 'mobility_white', 'queen_black',
+                 'queen_white', 'king_black', 'king_white')
+FEATURE_DTYPE = np.int16
+# 每局的特征数组较大，对局库按比其他阶段更小的区间分块
+STORE_CHUNK_GAMES = 20000
+FULL_MASK = (1 << 64) - 1
+
+
+def build_direction_masks():
+    # 沿某方向移动一格后仍在棋盘内的落点，避免 y 方向越界绕到相邻一行
+    masks = []
+    for dx, dy in DIRECTIONS:
+        mask = 0
+        for square in range(64):
+            if 0 <= square % 8 - dy < 8:
+                mask |= 1 << square
+        masks.append(mask)
+    return tuple(masks)
+
+
+DIRECTION_MASKS = build_direction_masks()
+
+
+def shift(bits, step):
+    return (bits << step) & FULL_MASK if step > 0 else bits >> -step
+
+
+def queen_fill(sources, empty):
+    # 所有 sources 同时沿八个方向滑动，返回一次皇后走法能到达的空格
+    reach = 0
+    for step, mask in zip(DIRECTION_STEPS, DIRECTION_MASKS):
+        ray = sources
+        while ray:
+            ray = shift(ray, step) & mask & empty
+            reach |= ray
+    return reach
+
+
+def king_fill(sources, empty):
+    reach = 0
+    for step, mask in zip(DIRECTION_STEPS, DIRECTION_MASKS):
+        reach |= shift(sources, step) & mask
+    return reach & empty
+
+
+def distance_layers(sources, empty, fill):
+    # 逐层扩展，第 d 层为距离恰好为 d + 1 的空格
+    layers = []
+    reached = sources
+    frontier = sources
+    while True:
+        frontier = fill(frontier, empty) & ~reached
+        if not frontier:
+            return layers
+        layers.append(frontier)
+        reached |= frontier
+
+
+def territory(black, white, empty, fill):
+    black_layers = distance_layers(black, empty, fill)
+    white_layers = distance_layers(white, empty, fill)
+    black_count = white_count = 0
+    black_reached = white_reached = 0
+    for d in range(max(len(black_layers), len(white_layers))):
+        black_layer = black_layers[d] if d < len(black_layers) else 0
+        white_layer = white_layers[d] if d < len(white_layers) else 0
+        black_reached |= black_layer
+        white_reached |= white_layer
+        black_count += bin(black_layer & ~white_reached).count('1')
+        white_count += bin(white_layer & ~black_reached).count('1')
+    return black_count, white_count
+
+
+def position_features(chessboard: BitBoard):
+    empty = ~chessboard.occupied & FULL_MASK
+    black, white = chessboard.black, chessboard.white
+    black_mobility = count_moves_bitboard(chessboard, 1)
+    white_mobility = count_moves_bitboard(chessboard, -1)
+    return ((black_mobility, white_mobility) +
+            territory(black, white, empty, queen_fill) +
+            territory(black, white, empty, king_fill))
+
+
+def game_features(games):
+    # games 逐局产生 GameRecord，返回本批次内从 0 开始编号的对局下标
+    game_indices = []
+    plies = []
+    features = []
+    winners = []
+    for game_index, (moves, winner, bots) in enumerate(games):
+        chessboard = BitBoard()
+        for ply, (x0, y0, x1, y1, x2, y2) in enumerate(moves):
+            game_indices.append(game_index)
+            plies.append(ply)
+            features.append(position_features(chessboard))
+            chessboard.move_piece(x0, y0, x1, y1)
+            chessboard.place_block(x2, y2)
+        winners.append(winner)
+    game_indices = np.array(game_indices, dtype=np.int64)
+    plies = np.array(plies, dtype=np.int16)
+    features = np.array(features,
+                        dtype=FEATURE_DTYPE).reshape(-1, len(FEATURE_NAMES))
+    winners = np.array(winners, dtype=np.int8)
+    return game_indices, plies, features, winners
+
+
+def process_file(file_path):
+    try:
+        return game_features(iter_json_games(file_path))
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        return game_features([])
+
+
+def process_store_chunk(store_path, start, stop):
+    return game_features(iter_store_games(store_path, start, stop))
+
+
+def save_features(output_path, games, plies, features, winners):
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file,
+                 games=games,
+                 plies=plies,
+                 features=features,
+                 winners=winners,
+                 feature_names=np.array(FEATURE_NAMES))
+    os.replace(temp_path, output_path)
+
+
+def process_directory(directory_path,
+                      output_path,
+                      max_workers=8,
+                      overlapped=False):
+    if is_game_store(directory_path):
+        total_games = len(GameStore(directory_path))
+        tasks = [(process_store_chunk, directory_path, start,
+                  start + STORE_CHUNK_GAMES)
+                 for start in range(0, total_games, STORE_CHUNK_GAMES)]
+    else:
+        tasks = [(process_file, os.path.join(directory_path, file))
+                 for file in sorted(os.listdir(directory_path))
+                 if is_shard(file)]
+
+    # 按任务顺序收集结果，把各批次内的对局下标平移为全局下标；先放入空数组以确定类型
+    games, plies, features, winners = ([array] for array in game_features([]))
+    total_games = 0
+    with make_executor(max_workers, overlapped) as executor:
+        futures = [
+            executor.submit(run_task, 'features', index, *task)
+            for index, task in enumerate(tasks)
+        ]
+        for future in tqdm(futures, desc="Extracting features"):
+            batch_games, batch_plies, batch_features, batch_winners = (
+                load_result(future.result()))
+            games.append(batch_games + total_games)
+            plies.append(batch_plies)
+            features.append(batch_features)
+            winners.append(batch_winners)
+            total_games += len(batch_winners)
+
+    save_features(output_path, np.concatenate(games), np.concatenate(plies),
+                  np.concatenate(features), np.concatenate(winners))
+
+
+if __name__ == "__main__":
+    directory_path = r"E:\VSCPython\Amazons\dataset\merge"
+    output_path = r"E:\VSCPython\Amazons\dataset\features.npz"
+    process_directory(directory_path, output_path)
+    print(f"特征已写入: {output_path}")
@@ -1,7 +1,11 @@
 import os
-import json
+import shutil
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from json_stream import (iter_json_objects, write_json_array, is_shard,
+                         shard_compression, ShardWriter)
+from metrics import current_metrics, run_task
+from overlap import make_executor, load_result
 
 
 def load_bot_ids(bot_file_path):
@@ -9,77 +13,160 @@ def load_bot_ids(bot_file_path):
         return set(line.strip() for line in file)
 
 
+def has_bot(obj, bot_ids):
+    if 'players' in obj:
+        players = obj['players']
+        return any(player['bot'] in bot_ids for player in players)
+    return False
+
+
 def filter_json_objects(data, bot_ids):
     filtered_data = []
     for obj in data:
-        if 'players' in obj:
-            players = obj['players']
-            if any(player['bot'] in bot_ids for player in players):
-                filtered_data.append(obj)
+        if has_bot(obj, bot_ids):
+            filtered_data.append(obj)
     return filtered_data
 
 
 def process_json_file(file_path, bot_ids):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-
-        filtered_data = filter_json_objects(data, bot_ids)
-        return filtered_data
+        return filter_json_objects(iter_json_objects(file_path), bot_ids)
 
     except Exception as e:
         print(f"处理文件 {file_path} 时出错: {e}")
         return []
 
 
+def write_filtered_shards(file_path,
+                          bot_ids,
+                          temp_directory,
+                          base_name,
+                          max_objects,
+                          compression=None):
+    # 工作进程直接把匹配的对局写入临时分片，只把条数和分片路径返回给主进程
+    metrics = current_metrics()
+    try:
+        with ShardWriter(temp_directory,
+                         base_name,
+                         max_objects,
+                         compression=compression) as writer:
+            for obj in iter_json_objects(file_path):
+                metrics.add('games_in')
+                if has_bot(obj, bot_ids):
+                    writer.write(obj)
+                else:
+                    metrics.add('games_dropped')
+        metrics.add('games_kept', writer.total)
+        return writer.total, writer.paths
+
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        for path in writer.paths:
+            os.remove(path)
+        return 0, []
+
+
 def save_filtered_data(filtered_data,
                        output_directory,
                        base_name,
-                       max_objects=200):
+                       max_objects=200,
+                       compression=None):
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
     total_files = (len(filtered_data) + max_objects - 1) // max_objects
     for i in range(total_files):
         part_data = filtered_data[i * max_objects:(i + 1) * max_objects]
-        file_path = os.path.join(output_directory,
-                                 f"{base_name}_part{i+1}.json")
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write('[\n')
-            for j, obj in enumerate(part_data):
-                if j > 0:
-                    file.write(',\n')
-                json.dump(obj, file, ensure_ascii=False)
-            file.write('\n]')
+        file_path = os.path.join(
+            output_directory, f"{base_name}_part{i+1}.json{compression or ''}")
+        write_json_array(file_path, part_data)
         print(f"已保存文件: {file_path}")
 
 
+def process_directory_streaming(input_directory,
+                                output_directory,
+                                bot_file_path,
+                                max_workers=8,
+                                max_objects=200,
+                                compression=None):
+    # 各输入文件的最后一个分片可能不满 max_objects 条，主进程只按输入文件顺序重新编号
+    bot_ids = load_bot_ids(bot_file_path)
+    file_paths = sorted(
+        os.path.join(input_directory, file)
+        for file in os.listdir(input_directory) if is_shard(file))
+    temp_directory = os.path.join(output_directory, '.filter_bot_tmp')
+    os.makedirs(temp_directory, exist_ok=True)
+
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for index, file_path in enumerate(file_paths):
+                future = executor.submit(run_task, 'filter_bot', file_path,
+                                         write_filtered_shards, file_path,
+                                         bot_ids, temp_directory,
+                                         f"file{index}", max_objects,
+                                         compression)
+                futures[future] = index
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"处理过程中出现错误: {e}")
+
+        total_games = 0
+        part = 0
+        for index in sorted(results):
+            count, paths = results[index]
+            total_games += count
+            for path in paths:
+                part += 1
+                os.replace(
+                    path,
+                    os.path.join(
+                        output_directory,
+                        f"filtered_data_part{part}.json{shard_compression(path)}"
+                    ))
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+    print(f"共保存 {total_games} 局对局到 {part} 个文件: {output_directory}")
+
+
 def process_directory(input_directory,
                       output_directory,
                       bot_file_path,
                       max_workers=8,
-                      max_objects=200):
+                      max_objects=200,
+                      streaming=False,
+                      compression=None,
+                      overlapped=False):
+    if streaming:
+        return process_directory_streaming(input_directory, output_directory,
+                                           bot_file_path, max_workers,
+                                           max_objects, compression)
+
     bot_ids = load_bot_ids(bot_file_path)
 
     all_filtered_data = []
     file_paths = [
         os.path.join(input_directory, file)
-        for file in os.listdir(input_directory) if file.endswith('.json')
+        for file in os.listdir(input_directory) if is_shard(file)
     ]
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with make_executor(max_workers, overlapped) as executor:
         futures = [
-            executor.submit(process_json_file, file_path, bot_ids)
+            executor.submit(run_task, 'filter_bot', file_path,
+                            process_json_file, file_path, bot_ids)
             for file_path in file_paths
         ]
         for future in tqdm(as_completed(futures), total=len(futures)):
             try:
-                all_filtered_data.extend(future.result())
+                all_filtered_data.extend(load_result(future.result()))
             except Exception as e:
                 print(f"处理过程中出现错误: {e}")
 
     save_filtered_data(all_filtered_data, output_directory, 'filtered_data',
-                       max_objects)
+                       max_objects, compression)
 
 
 if __name__ == "__main__":
@@ -92,4 +179,5 @@ if __name__ == "__main__":
                       output_directory,
                       bot_file_path,
                       max_workers=max_workers,
-                      max_objects=max_objects)
+                      max_objects=max_objects,
+                      streaming=True)
@@ -1,51 +1,84 @@
 import os
-import json
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from manifest import Manifest, call_stage
+from json_stream import (rewrite_if_changed, is_shard, open_shard,
+                         is_empty_shard)
+from metrics import current_metrics, run_task
+
+
+def has_err(obj):
+    return any("err" in log.get("output", {}).get("display", {})
+               for log in obj.get("log", []))
+
+
+def has_err_text(file_path):
+    # display 为字典、列表或字符串时，命中的对象原始文本中都含有 err，或者写成了 \u 转义；
+    # 两者都没有时解码后也不会有对象被删除，只是用来跳过整份文件的解码
+    current_metrics().add('bytes_read', os.path.getsize(file_path))
+    with open_shard(file_path) as file:
+        return any('err' in line or '\\u' in line for line in file)
 
 
 def remove_err_objects(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
+        filtered_count = None
+        if has_err_text(file_path):
+            filtered_count = rewrite_if_changed(
+                file_path, lambda obj: None if has_err(obj) else obj)
 
-        filtered_data = []
-        for obj in data:
-            if not any("err" in log.get("output", {}).get("display", {})
-                       for log in obj.get("log", [])):
-                filtered_data.append(obj)
-
-        if not filtered_data:
+        if filtered_count is None:
+            if not is_empty_shard(file_path):
+                return True
+            filtered_count = 0  # 空数组文件与原先一样删除
+        if not filtered_count:
             os.remove(file_path)
             print(f"已删除空文件: {file_path}")
         else:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                json.dump(filtered_data, file, ensure_ascii=False, indent=4)
             print(f"已处理文件: {file_path}")
+        return True
     except Exception as e:
         print(f"处理文件 {file_path} 时出错: {e}")
+        return False
 
 
-def process_directory(directory_path, max_workers=8):
+def process_directory(directory_path, max_workers=8, manifest_path=None):
     file_paths = []
     for root, dirs, files in os.walk(directory_path):
         for file in files:
-            if file.endswith('.json'):
+            if is_shard(file):
                 file_paths.append(os.path.join(root, file))
 
+    manifest = Manifest(manifest_path) if manifest_path else None
+    if manifest is not None:
+        file_paths = manifest.pending('filter_json_err', file_paths)
+
+    with_fingerprint = manifest is not None
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(remove_err_objects, file_path)
-            for file_path in file_paths
-        ]
+        futures = {}
+        for file_path in file_paths:
+            future = executor.submit(run_task, 'filter_json_err', file_path,
+                                     call_stage, remove_err_objects, file_path,
+                                     (), with_fingerprint)
+            futures[future] = file_path
         for future in tqdm(as_completed(futures), total=len(futures)):
             try:
-                future.result()
+                done, fingerprint = future.result()
+                if manifest is not None and fingerprint is not None and done:
+                    file_path = futures[future]
+                    manifest.record('filter_json_err', file_path, fingerprint,
+                                    [file_path])
             except Exception as e:
                 print(f"处理过程中出现错误: {e}")
 
+    if manifest is not None:
+        manifest.compact()
+
 
 if __name__ == "__main__":
     directory_path = r"E:\VSCPython\Amazons\dataset"
     max_workers = 8
-    process_directory(directory_path, max_workers=max_workers)
+    manifest_path = r"E:\VSCPython\Amazons\dataset\manifest.jsonl"
+    process_directory(directory_path,
+                      max_workers=max_workers,
+                      manifest_path=manifest_path)
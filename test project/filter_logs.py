@@ -1,12 +1,16 @@
 import os
-import json
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from manifest import Manifest, call_stage
+from json_stream import rewrite_if_changed, is_shard
+from metrics import run_task
+
+# 精简后的日志只剩双方的着法和最后的 finish，不超过 10 条（原始日志带着 request，不超过 20 条）的对局太短，丢弃。
+# 按精简后的长度判断，已处理过的日志再处理一遍结果不变
+SHORT_LOG_ENTRIES = 10
 
 
 def process_log(log):
-    if len(log) <= 20:
-        return None
     new_log = []
     for entry in log:
         if '0' in entry or '1' in entry:
@@ -33,6 +37,8 @@ def process_log(log):
                 new_log.append(entry)
             else:
                 new_log.append(entry)
+    if len(new_log) <= SHORT_LOG_ENTRIES:
+        return None
     return new_log
 
 
@@ -56,46 +62,51 @@ def process_json_object(json_object):
 
 def process_json_file(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-
-        processed_data = []
-        for obj in data:
-            processed_obj = process_json_object(obj)
-            if processed_obj is not None:
-                processed_data.append(processed_obj)
-
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write('[\n')
-            for i, obj in enumerate(data):
-                if i > 0:
-                    file.write(',\n')
-                json.dump(obj, file, ensure_ascii=False)
-            file.write('\n]')
+        # 已处理过的文件重新运行时各对象不再变化，不会重写
+        rewrite_if_changed(file_path, process_json_object)
+        return True
     except Exception as e:
         print(f"处理文件 {file_path} 时出错: {e}")
+        return False
 
 
-def process_directory(directory_path, max_workers=8):
+def process_directory(directory_path, max_workers=8, manifest_path=None):
     file_paths = []
     for root, dirs, files in os.walk(directory_path):
         for file in files:
-            if file.endswith('.json'):
+            if is_shard(file):
                 file_paths.append(os.path.join(root, file))
 
+    manifest = Manifest(manifest_path) if manifest_path else None
+    if manifest is not None:
+        file_paths = manifest.pending('filter_logs', file_paths)
+
+    with_fingerprint = manifest is not None
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(process_json_file, file_path)
-            for file_path in file_paths
-        ]
+        futures = {}
+        for file_path in file_paths:
+            future = executor.submit(run_task, 'filter_logs', file_path,
+                                     call_stage, process_json_file, file_path,
+                                     (), with_fingerprint)
+            futures[future] = file_path
         for future in tqdm(as_completed(futures), total=len(futures)):
             try:
-                future.result()
+                done, fingerprint = future.result()
+                if manifest is not None and fingerprint is not None and done:
+                    file_path = futures[future]
+                    manifest.record('filter_logs', file_path, fingerprint,
+                                    [file_path])
             except Exception as e:
                 print(f"处理过程中出现错误: {e}")
 
+    if manifest is not None:
+        manifest.compact()
+
 
 if __name__ == "__main__":
     directory_path = r"E:\VSCPython\Amazons\dataset\merge"
     max_workers = 16
-    process_directory(directory_path, max_workers=max_workers)
+    manifest_path = r"E:\VSCPython\Amazons\dataset\manifest.jsonl"
+    process_directory(directory_path,
+                      max_workers=max_workers,
+                      manifest_path=manifest_path)
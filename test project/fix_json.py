@@ -1,61 +1,168 @@
 import os
+import re
 import json
+import time
+from bisect import bisect_right
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from manifest import Manifest, call_stage
+from json_stream import write_json_array, is_shard, open_shard
+from metrics import current_metrics, run_task
 
+_decoder = json.JSONDecoder()
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+# 字符串字面量整体匹配，其中的花括号不参与计数；原始 JSON 的字符串不含换行，未闭合的引号最多影响到行尾
+_BRACE_TOKEN = re.compile(r'"[^"\\\n]*(?:\\.[^"\\\n]*)*"|[{}]')
 
-def fix_json_file(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
 
-        json_objects = []
-        buffer = ''
-        depth = 0
+def index_braces(content):
+    # 一次正向扫描字符串外的花括号，返回：
+    #   starts  可能是新对象开头的 { 的位置。合法 JSON 内部的 { 前面（跳过空白）一定是 [ : 或 ,，
+    #           其他字符后面的 { 只能是首尾相接的下一个对象，从这里同步不会取出残缺对象内部的片段；
+    #           行首的 { 也算（对象被截断在 , 或 : 之后的情形），缩进输出中嵌套的 { 不会出现在行首
+    #   ends    每个配对的 { 对应的 } 之后的位置
+    starts = []
+    ends = {}
+    stack = []
+    for match in _BRACE_TOKEN.finditer(content):
+        token = match.group()
+        start = match.start()
+        if token == '{':
+            stack.append(start)
+            before = start - 1
+            while before >= 0 and content[before] in ' \t\n\r':
+                before -= 1
+            if (before < 0 or content[before] not in '[:,'
+                    or content[start - 1] == '\n'):
+                starts.append(start)
+        elif token == '}' and stack:
+            ends[stack.pop()] = match.end()
+    return starts, ends
+
+
+def scan_json_objects(content):
+    # 线性扫描首尾相接的 JSON 对象，返回可解码的对象和损坏片段的字符区间。
+    # 解码出错时 JSONDecodeError 会从文件开头数行号，第一次出错后改为按括号索引逐个对象解码：
+    # 配对的 { 只解码到对应的 }，不配对的 { 和其他零散字符一定是损坏的，直接跳到下一个可能的对象开头
+    json_objects = []
+    corrupt_spans = []
+    brace_index = None
+    pos = 0
+    while True:
+        match = _NON_WHITESPACE.search(content, pos)
+        if not match:
+            break
+        pos = match.start()
+        try:
+            if brace_index is None or content[pos] == '[':
+                obj, pos = _decoder.raw_decode(content, pos)
+            else:
+                starts, ends = brace_index
+                end = ends.get(pos, -1)
+                if end == -1:
+                    raise ValueError
+                obj, length = _decoder.raw_decode(content[pos:end])
+                pos += length
+        except ValueError:
+            if brace_index is None:
+                brace_index = index_braces(content)
+            starts, ends = brace_index
+            i = bisect_right(starts, pos)
+            end = starts[i] if i < len(starts) else len(content)
+            # 括号配对的损坏对象到它自己的 } 为止
+            end = min(end, ends.get(pos, end))
+            corrupt_spans.append((pos, end))
+            pos = end
+            continue
+        if isinstance(obj, list):
+            json_objects.extend(obj)
+        else:
+            json_objects.append(obj)
+    return json_objects, corrupt_spans
+
 
-        for char in content:
-            if char == '{':
-                depth += 1
-            elif char == '}':
-                depth -= 1
+def to_byte_spans(content, spans):
+    byte_spans = []
+    char_pos = byte_pos = 0
+    for start, end in spans:
+        byte_pos += len(content[char_pos:start].encode('utf-8'))
+        byte_start = byte_pos
+        byte_pos += len(content[start:end].encode('utf-8'))
+        char_pos = end
+        byte_spans.append((byte_start, byte_pos))
+    return byte_spans
 
-            buffer += char
 
-            if depth == 0 and buffer.strip():
-                try:
-                    json_objects.append(json.loads(buffer))
-                except json.JSONDecodeError as e:
-                    print(f"JSON解码错误: {e} 在文件 {file_path}")
-                    return
-                buffer = ''
+def fix_json_file(file_path, recover=False):
+    metrics = current_metrics()
+    try:
+        start = time.perf_counter()
+        with open_shard(file_path) as file:
+            content = file.read()
+        parse_start = time.perf_counter()
+        metrics.add_time('read', parse_start - start)
+        metrics.add('bytes_read', os.path.getsize(file_path))
+
+        json_objects, corrupt_spans = scan_json_objects(content)
+        metrics.add_time('parse', time.perf_counter() - parse_start)
+        metrics.add('games_in', len(json_objects) + len(corrupt_spans))
+        metrics.add('games_dropped', len(corrupt_spans))
+        byte_spans = to_byte_spans(content, corrupt_spans)
+        for start, end in byte_spans:
+            print(f"JSON解码错误: 字节 {start}-{end} 在文件 {file_path}")
+        if byte_spans and not recover:
+            return byte_spans
 
-        with open(file_path, 'w', encoding='utf-8') as file:
-            json.dump(json_objects, file, ensure_ascii=False, indent=4)
+        metrics.add('games_kept', write_json_array(file_path, json_objects))
+        return byte_spans
 
     except Exception as e:
         print(f"处理文件 {file_path} 时出错: {e}")
 
 
-def process_directory(directory_path, max_workers=8):
+def process_directory(directory_path,
+                      max_workers=8,
+                      recover=False,
+                      manifest_path=None):
     file_paths = []
     for root, dirs, files in os.walk(directory_path):
         for file in files:
-            if file.endswith('.json'):
+            if is_shard(file):
                 file_paths.append(os.path.join(root, file))
 
+    manifest = Manifest(manifest_path) if manifest_path else None
+    if manifest is not None:
+        file_paths = manifest.pending('fix_json', file_paths)
+
+    with_fingerprint = manifest is not None
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(fix_json_file, file_path)
-            for file_path in file_paths
-        ]
+        futures = {}
+        for file_path in file_paths:
+            future = executor.submit(run_task, 'fix_json', file_path,
+                                     call_stage, fix_json_file, file_path,
+                                     (recover, ), with_fingerprint)
+            futures[future] = file_path
         for future in tqdm(as_completed(futures), total=len(futures)):
             try:
-                future.result()
+                byte_spans, fingerprint = future.result()
+                fixed = byte_spans is not None and (recover or not byte_spans)
+                if manifest is not None and fingerprint is not None and fixed:
+                    file_path = futures[future]
+                    manifest.record('fix_json', file_path, fingerprint,
+                                    [file_path])
             except Exception as e:
                 print(f"处理过程中出现错误: {e}")
 
+    if manifest is not None:
+        manifest.compact()
+
 
 if __name__ == "__main__":
     directory_path = r"E:\VSCPython\Amazons\dataset"
     max_workers = 8
-    process_directory(directory_path, max_workers=max_workers)
+    manifest_path = r"E:\VSCPython\Amazons\dataset\manifest.jsonl"
+    recover = True
+    process_directory(directory_path,
+                      max_workers=max_workers,
+                      recover=recover,
+                      manifest_path=manifest_path)
@@ -0,0 +1,143 @@
+import os
+import json
+from array import array
+import numpy as np
+from tqdm import tqdm
+from json_stream import iter_json_objects, is_shard
+from json_backend import GameRecord, decode_game
+from metrics import current_metrics, run_task
+
+# 目录形式的二进制对局库：
+#   moves.npy    (总步数, 6) uint8，每步的 x0, y0, x1, y1, x2, y2
+#   offsets.npy  (对局数 + 1,) int64，第 i 局的着法为 moves[offsets[i]:offsets[i + 1]]
+#   winners.npy  (对局数,) int8，0 为黑方胜，1 为白方胜
+#   bots.npy     (对局数, 2) int32，双方 bot 在 bot_names.json 中的下标，缺失为 -1
+MOVE_FIELDS = ("x0", "y0", "x1", "y1", "x2", "y2")
+# 各分析阶段按对局区间把对局库分给工作进程时，每个任务的对局数
+STORE_CHUNK_GAMES = 100000
+
+
+def is_game_store(path):
+    return os.path.isfile(os.path.join(path, 'moves.npy'))
+
+
+def append_json_games(file_path, moves, offsets, winners, bots, bot_names):
+    metrics = current_metrics()
+    invalid_games = 0
+    for game in iter_json_objects(file_path, decode=decode_game):
+        metrics.add('games_in')
+        # array('B') 接受 0-255，坐标须先检查在棋盘内，否则打包着法编号时会串到相邻的下标
+        if any(not 0 <= value < 8 for move in game.moves for value in move):
+            invalid_games += 1
+            continue
+        # 先把一局的着法、胜方和 bot 都算好，再一起追加，出错的对局不会让 offsets、winners、bots 错位
+        game_moves = array('B')
+        for move in game.moves:
+            game_moves.extend(array('B', move))
+        game_bots = []
+        for bot in game.bots:
+            if bot is None:
+                game_bots.append(-1)
+            else:
+                game_bots.append(bot_names.setdefault(bot, len(bot_names)))
+
+        moves.extend(game_moves)
+        offsets.append(len(moves) // 6)
+        winners.append(game.winner)
+        bots.extend(game_bots)
+        metrics.add('games_kept')
+    metrics.add('games_dropped', invalid_games)
+    if invalid_games:
+        print(f"文件 {file_path} 中有 {invalid_games} 局对局坐标越界，已跳过")
+    return len(winners)
+
+
+def build_game_store(json_paths, store_path):
+    moves = array('B')
+    offsets = array('q', [0])
+    winners = array('b')
+    bots = array('i')
+    bot_names = {}
+
+    # 在主进程中逐个文件读取，同样经 run_task 记录每个文件的指标
+    for file_path in tqdm(json_paths, desc="Building game store"):
+        try:
+            run_task('game_store', file_path, append_json_games, file_path,
+                     moves, offsets, winners, bots, bot_names)
+        except Exception as e:
+            print(f"处理文件 {file_path} 时出错: {e}")
+
+    os.makedirs(store_path, exist_ok=True)
+    np.save(os.path.join(store_path, 'moves.npy'),
+            np.frombuffer(moves, dtype=np.uint8).reshape(-1, 6))
+    np.save(os.path.join(store_path, 'offsets.npy'),
+            np.frombuffer(offsets, dtype=np.int64))
+    np.save(os.path.join(store_path, 'winners.npy'),
+            np.frombuffer(winners, dtype=np.int8))
+    np.save(os.path.join(store_path, 'bots.npy'),
+            np.frombuffer(bots, dtype=np.int32).reshape(-1, 2))
+    with open(os.path.join(store_path, 'bot_names.json'),
+              'w',
+              encoding='utf-8') as file:
+        json.dump(sorted(bot_names, key=bot_names.get),
+                  file,
+                  ensure_ascii=False)
+    return len(winners)
+
+
+class GameStore:
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.moves = np.load(os.path.join(store_path, 'moves.npy'),
+                             mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_path, 'offsets.npy'),
+                               mmap_mode='r')
+        self.winners = np.load(os.path.join(store_path, 'winners.npy'),
+                               mmap_mode='r')
+        self.bots = np.load(os.path.join(store_path, 'bots.npy'),
+                            mmap_mode='r')
+        with open(os.path.join(store_path, 'bot_names.json'),
+                  'r',
+                  encoding='utf-8') as file:
+            self.bot_names = json.load(file)
+
+    def __len__(self):
+        return len(self.winners)
+
+    def game_moves(self, index):
+        return self.moves[self.offsets[index]:self.offsets[index + 1]]
+
+    def game_bots(self, index):
+        return [
+            self.bot_names[bot] if bot >= 0 else None
+            for bot in self.bots[index]
+        ]
+
+
+# 各分析阶段共用的对局读取：逐局产生 GameRecord，着法为 (x0, y0, x1, y1, x2, y2) 序列
+def iter_json_games(file_path):
+    return iter_json_objects(file_path, decode=decode_game)
+
+
+def iter_store_games(store_path, start=0, stop=None):
+    store = GameStore(store_path)
+    stop = len(store) if stop is None else min(stop, len(store))
+    for index in range(start, stop):
+        yield GameRecord(
+            store.game_moves(index).tolist(), int(store.winners[index]),
+            store.game_bots(index))
+
+
+def process_directory(input_directory, store_path):
+    json_paths = sorted(
+        os.path.join(input_directory, file)
+        for file in os.listdir(input_directory) if is_shard(file))
+    total_games = build_game_store(json_paths, store_path)
+    print(f"已写入 {total_games} 局对局: {store_path}")
+
+
+if __name__ == "__main__":
+    input_directory = r"E:\VSCPython\Amazons\dataset\merge"
+    store_path = r"E:\VSCPython\Amazons\dataset\store"
+    process_directory(input_directory, store_path)
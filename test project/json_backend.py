@@ -0,0 +1,123 @@
+import os
+import json
+from collections import namedtuple
+from typing import List, Optional
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 解码后端：优先 msgspec，其次 orjson，都没有安装时用标准库 json；
+# 环境变量 AMAZONS_JSON_BACKEND 可以指定为 msgspec / orjson / json，便于对比各后端。
+# 写出仍统一用标准库 json.dumps(ensure_ascii=False)，保证输出与已有文件逐字节一致。
+# 快速后端不接受孤立代理项的转义（乱码对局），解码出错时退回标准库，结果与 json.loads 相同
+BACKEND_ENV = 'AMAZONS_JSON_BACKEND'
+BACKENDS = ('msgspec', 'orjson', 'json')
+# 分析阶段只需要的字段：着法为 (x0, y0, x1, y1, x2, y2) 元组的列表，winner 为 0 黑 1 白
+GameRecord = namedtuple('GameRecord', ['moves', 'winner', 'bots'])
+
+
+def select_backend(name=None):
+    name = name or os.environ.get(BACKEND_ENV)
+    if name is None:
+        if msgspec is not None:
+            return 'msgspec'
+        return 'orjson' if orjson is not None else 'json'
+    if name not in BACKENDS:
+        raise ValueError(f"未知的 JSON 后端: {name}")
+    if (name == 'msgspec' and msgspec is None
+            or name == 'orjson' and orjson is None):
+        raise ValueError(f"未安装 JSON 后端: {name}")
+    return name
+
+
+BACKEND = select_backend()
+_fast_loads = None
+_fast_errors = ()
+_decode_game_struct = None
+
+if BACKEND == 'msgspec':
+    # 按类型解码时 output、display、initdata 等未声明的字段直接跳过，不创建 Python 对象
+    class _Response(msgspec.Struct):
+        x0: int
+        y0: int
+        x1: int
+        y1: int
+        x2: int
+        y2: int
+
+    class _Turn(msgspec.Struct):
+        response: _Response
+
+    class _LogEntry(msgspec.Struct):
+        black: Optional[_Turn] = msgspec.field(default=None, name="0")
+        white: Optional[_Turn] = msgspec.field(default=None, name="1")
+
+    class _Player(msgspec.Struct):
+        bot: Optional[str] = None
+
+    class _Game(msgspec.Struct):
+        log: List[_LogEntry]
+        scores: list
+        players: List[_Player] = []
+
+    _fast_loads = msgspec.json.Decoder().decode
+    _fast_errors = (msgspec.DecodeError, )
+    _decode_game_struct = msgspec.json.Decoder(_Game).decode
+elif BACKEND == 'orjson':
+    _fast_loads = orjson.loads
+    _fast_errors = (orjson.JSONDecodeError, )
+
+
+def loads(data):
+    # data 可以是 str 或 UTF-8 编码的 bytes
+    if _fast_loads is not None:
+        try:
+            return _fast_loads(data)
+        except _fast_errors:
+            pass
+    return json.loads(data)
+
+
+def project_game(obj):
+    log = obj["log"]
+    moves = []
+    for i in range(len(log) - 1):
+        response = log[i][str(i % 2)]["response"]
+        moves.append((response["x0"], response["y0"], response["x1"],
+                      response["y1"], response["x2"], response["y2"]))
+    players = obj.get("players", [])
+    bots = [
+        players[k].get("bot") if k < len(players) else None for k in range(2)
+    ]
+    return GameRecord(moves, 0 if obj["scores"][0] == 2 else 1, bots)
+
+
+def project_game_struct(game):
+    log = game.log
+    moves = []
+    for i in range(len(log) - 1):
+        turn = log[i].white if i % 2 else log[i].black
+        if turn is None:
+            raise KeyError(str(i % 2))
+        response = turn.response
+        moves.append((response.x0, response.y0, response.x1, response.y1,
+                      response.x2, response.y2))
+    players = game.players
+    bots = [players[k].bot if k < len(players) else None for k in range(2)]
+    return GameRecord(moves, 0 if game.scores[0] == 2 else 1, bots)
+
+
+def decode_game(data):
+    # 只解码着法、胜方和双方 bot；结构不符合预期时按完整对象解码，出错方式与原先逐字段读取一致
+    if _decode_game_struct is not None:
+        try:
+            return project_game_struct(_decode_game_struct(data))
+        except _fast_errors:
+            pass
+    return project_game(loads(data))
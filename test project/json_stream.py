@@ -0,0 +1,398 @@
+import os
+import io
+import re
+import bz2
+import gzip
+import json
+import lzma
+import time
+from metrics import current_metrics
+from json_backend import loads
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+# 压缩分片按扩展名透明读写，例如 folder0_part1.json.gz；压缩和解压都在打开文件的进程中进行，
+# 各阶段把文件路径交给工作进程，解压自然分散到各工作进程。
+# 压缩级别依次取调用时传入的值、环境变量 AMAZONS_COMPRESS_LEVEL、各格式的默认值
+COMPRESSIONS = ('.gz', '.xz', '.bz2')
+SHARD_SUFFIXES = ('.json', ) + tuple('.json' + suffix
+                                     for suffix in COMPRESSIONS)
+COMPRESS_LEVEL_ENV = 'AMAZONS_COMPRESS_LEVEL'
+DEFAULT_COMPRESS_LEVELS = {'.gz': 6, '.xz': 6, '.bz2': 9}
+
+
+def is_shard(file_name):
+    return file_name.endswith(SHARD_SUFFIXES)
+
+
+def shard_compression(file_path):
+    for suffix in COMPRESSIONS:
+        if file_path.endswith(suffix):
+            return suffix
+    return ''
+
+
+def compress_level(compression, level=None):
+    if level is None:
+        level = os.environ.get(COMPRESS_LEVEL_ENV)
+    return DEFAULT_COMPRESS_LEVELS[compression] if level is None else int(
+        level)
+
+
+def open_shard(file_path, mode='r', compression=None, compresslevel=None):
+    # mode 为 'r' / 'w'（UTF-8 文本）或 'rb' / 'wb'；
+    # compression 为 None 时按扩展名判断，为 '' 时不压缩
+    if compression is None:
+        compression = shard_compression(file_path)
+    binary = 'b' in mode
+    if not compression:
+        if binary:
+            return open(file_path, mode)
+        return open(file_path, mode, encoding='utf-8')
+
+    raw_mode = mode[0] + 'b'
+    # 读取时不需要压缩级别，GzipFile 和 BZ2File 仍要求传入一个合法值
+    level = compress_level(compression, compresslevel) if 'w' in mode else None
+    if compression == '.gz':
+        # 头部不写入时间戳，相同内容总是压缩成相同的字节，按内容哈希的缓存才能复用
+        file = gzip.GzipFile(file_path,
+                             raw_mode,
+                             compresslevel=9 if level is None else level,
+                             mtime=0)
+    elif compression == '.xz':
+        file = lzma.LZMAFile(file_path, raw_mode, preset=level)
+    else:
+        file = bz2.BZ2File(file_path,
+                           raw_mode,
+                           compresslevel=9 if level is None else level)
+    return file if binary else io.TextIOWrapper(file, encoding='utf-8')
+
+
+class _StreamBuffer:
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        self.metrics = current_metrics()
+        self.read_time = 0.0
+
+    def fill(self, size):
+        start = time.perf_counter()
+        chunk = self.file.read(size)
+        elapsed = time.perf_counter() - start
+        self.read_time += elapsed
+        self.metrics.add_time('read', elapsed)
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # 跳过空白并返回下一个字符，读到文件末尾时返回空串
+        while True:
+            match = _NON_WHITESPACE.search(self.text, self.pos)
+            if match:
+                self.pos = match.start()
+                return self.text[self.pos]
+            self.pos = len(self.text)
+            if not self.fill(self.chunk_size):
+                return ''
+
+    def decode(self, raw=False):
+        # 缓冲区里的对象不完整时继续读入，每次读入量翻倍，避免大对象反复重解析
+        # raw 为 True 时返回该对象在文件中的原始文本
+        size = self.chunk_size
+        start = time.perf_counter()
+        read_time = self.read_time
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            if end == len(self.text) and not self.eof and self.fill(size):
+                continue
+            # 解析耗时不含其间读文件的时间
+            self.metrics.add_time(
+                'parse',
+                time.perf_counter() - start - (self.read_time - read_time))
+            begin, self.pos = self.pos, end
+            return self.text[begin:end] if raw else obj
+
+
+def iter_json_stream(file, chunk_size=CHUNK_SIZE, raw=False):
+    # 顶层为数组时逐个产生数组元素，否则逐个产生首尾相接的 JSON 值
+    reader = _StreamBuffer(file, chunk_size)
+    if reader.peek() != '[':
+        while reader.peek():
+            yield reader.decode(raw)
+        return
+
+    reader.pos += 1
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.decode(raw)
+        char = reader.peek()
+        if char == ']':
+            return
+        if char != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", reader.text,
+                                       reader.pos)
+        reader.pos += 1
+
+
+class _NotOnePerLine(Exception):
+    pass
+
+
+def _iter_json_lines(file, raw, decode):
+    # 本仓库写出的文件每行一个顶层对象：数组的方括号单独成行，逗号跟在行尾。
+    # 整行直接交给 decode，不必逐字符确定对象边界；缩进或跨行的对象说明不是这种格式
+    metrics = current_metrics()
+    start = time.perf_counter()
+    for line in file:
+        parse_start = time.perf_counter()
+        metrics.add_time('read', parse_start - start)
+        line = line.rstrip()
+        if line in (b'', b'[', b']', b'[]'):
+            start = time.perf_counter()
+            continue
+        if line.endswith(b','):
+            line = line[:-1]
+        if line[:1] != b'{' or line[-1:] != b'}':
+            raise _NotOnePerLine()
+        try:
+            value = decode(line)
+            if raw:
+                value = line.decode('utf-8')
+        except ValueError:
+            raise _NotOnePerLine()
+        metrics.add_time('parse', time.perf_counter() - parse_start)
+        yield value
+        start = time.perf_counter()
+
+
+def iter_json_objects(file_path,
+                      chunk_size=CHUNK_SIZE,
+                      raw=False,
+                      decode=None):
+    # 先按每行一个对象快速解码；不是这种格式或遇到损坏的行时改用流式解析，
+    # 跳过已经产生的对象后继续，出错位置和异常与流式解析一致。
+    # decode 作用于每个对象的原始文本，例如只取部分字段的 decode_game，默认解码为完整对象
+    count = 0
+    try:
+        with open_shard(file_path, 'rb') as file:
+            current_metrics().add('bytes_read',
+                                  os.fstat(file.fileno()).st_size)
+            for value in _iter_json_lines(file, raw, decode or loads):
+                yield value
+                count += 1
+        return
+    except _NotOnePerLine:
+        pass
+
+    with open_shard(file_path) as file:
+        current_metrics().add('bytes_read', os.fstat(file.fileno()).st_size)
+        for value in iter_json_stream(file, chunk_size, raw
+                                      or decode is not None):
+            if count:
+                count -= 1
+            elif raw or decode is None:
+                yield value
+            else:
+                yield decode(value)
+
+
+def is_empty_shard(file_path):
+    # 只读第一个对象；用完立即关闭文件，之后才能删除
+    objects = iter_json_objects(file_path, raw=True)
+    try:
+        return next(objects, None) is None
+    finally:
+        objects.close()
+
+
+def write_json_array(file_path,
+                     objects,
+                     raw=False,
+                     compression=None,
+                     compresslevel=None):
+    # raw 为 True 时 objects 是已经序列化好的 JSON 文本，原样写出；
+    # compression 为 None 时按 file_path 的扩展名决定是否压缩
+    metrics = current_metrics()
+    count = 0
+    with open_shard(file_path, 'w', compression, compresslevel) as file:
+        file.write('[\n')
+        for obj in objects:
+            if count > 0:
+                file.write(',\n')
+            if raw:
+                text = obj
+            else:
+                start = time.perf_counter()
+                text = json.dumps(obj, ensure_ascii=False)
+                metrics.add_time('serialize', time.perf_counter() - start)
+            start = time.perf_counter()
+            file.write(text)
+            metrics.add_time('write', time.perf_counter() - start)
+            count += 1
+        file.write('\n]')
+        # 关闭时写出缓冲区，压缩分片还要压缩剩余的数据，一并计入写入时间
+        start = time.perf_counter()
+    metrics.add_time('write', time.perf_counter() - start)
+    metrics.add('bytes_written', os.path.getsize(file_path))
+    return count
+
+
+def rewrite_json_array(file_path, objects, raw=False):
+    # 先写入临时文件再替换原文件，objects 可以是边读原文件边产生的生成器；压缩格式与原文件相同
+    temp_path = file_path + '.tmp'
+    try:
+        count = write_json_array(temp_path, objects, raw,
+                                 shard_compression(file_path))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, file_path)
+    return count
+
+
+def rewrite_if_changed(file_path, transform, raw=False):
+    # transform 返回处理后的对象，返回 None 表示丢弃该对象；raw 为 True 时处理的是原始文本。
+    # 先只读扫描，直到遇到第一个会被丢弃或改动的对象；全部不变时不写文件并返回 None，
+    # 否则从头重写（先写临时文件再替换）并返回保留的对象数
+    metrics = current_metrics()
+
+    def encode(text):
+        if raw:
+            start = time.perf_counter()
+            text = transform(text)
+            metrics.add_time('transform', time.perf_counter() - start)
+            return text
+        start = time.perf_counter()
+        obj = json.loads(text)
+        parsed = time.perf_counter()
+        obj = transform(obj)
+        transformed = time.perf_counter()
+        metrics.add_time('parse', parsed - start)
+        metrics.add_time('transform', transformed - parsed)
+        if obj is None:
+            return None
+        text = json.dumps(obj, ensure_ascii=False)
+        metrics.add_time('serialize', time.perf_counter() - transformed)
+        return text
+
+    scanned = 0
+    for text in iter_json_objects(file_path, raw=True):
+        if encode(text) != text:
+            break
+        scanned += 1
+    else:
+        metrics.add('games_in', scanned)
+        metrics.add('games_kept', scanned)
+        return None
+
+    def kept_texts():
+        for text in iter_json_objects(file_path, raw=True):
+            metrics.add('games_in')
+            text = encode(text)
+            if text is None:
+                metrics.add('games_dropped')
+            else:
+                metrics.add('games_kept')
+                yield text
+
+    return rewrite_json_array(file_path, kept_texts(), raw=True)
+
+
+class ShardWriter:
+    # 当前分片达到 max_objects 条或再写一条会超过 max_bytes 字节时换下一个文件，
+    # 两个上限都可以为 None，max_bytes 按压缩前的大小计算；内存中只保留正在写的一条对象。
+    # compression 为 '.gz' / '.xz' / '.bz2' 时写出压缩分片
+
+    def __init__(self,
+                 output_directory,
+                 base_name,
+                 max_objects=200,
+                 max_bytes=None,
+                 compression=None,
+                 compresslevel=None):
+        self.output_directory = output_directory
+        self.base_name = base_name
+        self.max_objects = max_objects
+        self.max_bytes = max_bytes
+        self.compression = compression or ''
+        self.compresslevel = compresslevel
+        self.paths = []
+        self.file = None
+        self.count = 0
+        self.size = 0
+        self.total = 0
+        self.metrics = current_metrics()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open_next(self):
+        self.close()
+        os.makedirs(self.output_directory, exist_ok=True)
+        file_path = os.path.join(
+            self.output_directory,
+            f"{self.base_name}_part{len(self.paths)+1}.json{self.compression}")
+        self.file = open_shard(file_path, 'w', self.compression,
+                               self.compresslevel)
+        self.file.write('[\n')
+        self.paths.append(file_path)
+        self.count = 0
+        self.size = 4  # 开头的 "[\n" 和结尾的 "\n]"
+
+    def is_full(self, size):
+        if self.max_objects is not None and self.count >= self.max_objects:
+            return True
+        return (self.max_bytes is not None and self.count > 0
+                and self.size + size + 2 > self.max_bytes)
+
+    def write(self, obj, raw=False):
+        # raw 为 True 时 obj 是已经序列化好的 JSON 文本，原样写出
+        if raw:
+            text = obj
+        else:
+            start = time.perf_counter()
+            text = json.dumps(obj, ensure_ascii=False)
+            self.metrics.add_time('serialize', time.perf_counter() - start)
+        size = len(text.encode('utf-8')) if self.max_bytes is not None else 0
+        if self.file is None or self.is_full(size):
+            self._open_next()
+        elif self.count > 0:
+            self.file.write(',\n')
+            self.size += 2
+        start = time.perf_counter()
+        self.file.write(text)
+        self.metrics.add_time('write', time.perf_counter() - start)
+        self.size += size
+        self.count += 1
+        self.total += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.write('\n]')
+            start = time.perf_counter()
+            self.file.close()
+            self.metrics.add_time('write', time.perf_counter() - start)
+            self.metrics.add('bytes_written', os.path.getsize(self.paths[-1]))
+            self.file = None
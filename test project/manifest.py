@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(file_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'hash': file_hash(file_path)
+    }
+
+
+def call_stage(func, file_path, args=(), with_fingerprint=False):
+    # 在工作进程中执行阶段函数，需要时顺带计算处理后文件的指纹（文件被删除时为 None）
+    result = func(file_path, *args)
+    if not with_fingerprint or not os.path.exists(file_path):
+        return result, None
+    return result, file_fingerprint(file_path)
+
+
+class Manifest:
+    # JSON Lines 格式，每处理完一个文件追加一行；中断后重新运行时已记录的文件会被跳过
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.records = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 中断时只写了一半的最后一行
+                    key = (record['stage'], record['input'])
+                    if record.get('deleted'):
+                        self.records.pop(key, None)
+                    else:
+                        self.records[key] = record
+
+    def lookup(self, stage, file_path):
+        # 输入文件未变化且产物都还在时返回对应记录，否则返回 None
+        record = self.records.get((stage, os.path.abspath(file_path)))
+        if record is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if stat.st_size != record['size']:
+            return None
+        if stat.st_mtime_ns != record['mtime']:
+            if file_hash(file_path) != record['hash']:
+                return None
+            record = self.record(
+                stage, file_path, {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                    'hash': record['hash']
+                }, record['outputs'])
+        if not all(os.path.exists(output) for output in record['outputs']):
+            return None
+        return record
+
+    def pending(self, stage, file_paths):
+        return [
+            file_path for file_path in file_paths
+            if self.lookup(stage, file_path) is None
+        ]
+
+    def record(self, stage, file_path, fingerprint=None, outputs=()):
+        if fingerprint is None:
+            fingerprint = file_fingerprint(file_path)
+        record = {
+            'stage': stage,
+            'input': os.path.abspath(file_path),
+            'size': fingerprint['size'],
+            'mtime': fingerprint['mtime'],
+            'hash': fingerprint['hash'],
+            'outputs': [os.path.abspath(output) for output in outputs],
+        }
+        self.records[(stage, record['input'])] = record
+        self._append(record)
+        return record
+
+    def inputs(self, stage):
+        return [input for (s, input) in self.records if s == stage]
+
+    def forget(self, stage, file_path):
+        key = (stage, os.path.abspath(file_path))
+        if self.records.pop(key, None) is not None:
+            self._append({'stage': stage, 'input': key[1], 'deleted': True})
+
+    def _append(self, record):
+        with open(self.manifest_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def compact(self):
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for record in self.records.values():
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_path, self.manifest_path)
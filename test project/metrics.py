@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import pickle
+import cProfile
+from collections import defaultdict
+
+# 各阶段每个任务的计数和计时，任务结束后以 JSON Lines 追加写出，由环境变量开启，工作进程自动继承：
+#   AMAZONS_METRICS  指标文件路径
+#   AMAZONS_PROFILE  性能分析目录，每个工作进程按阶段累积 cProfile 结果，写到 阶段_进程号.prof
+# 计数：
+#   bytes_read / bytes_written     读写的文件字节数
+#   games_in / games_kept / games_dropped
+#   result_bytes                   任务结果序列化后回传给主进程的字节数
+# 计时（秒）：
+#   read       从磁盘读取并解码为文本
+#   parse      JSON 解析
+#   transform  筛选和改写对象
+#   serialize  JSON 序列化
+#   write      写入磁盘
+#   pickle     任务结果的序列化
+# wall 为任务总耗时（不含 pickle），减去其余各项计时即为其他计算
+METRICS_ENV = 'AMAZONS_METRICS'
+PROFILE_ENV = 'AMAZONS_PROFILE'
+COUNTERS = ('bytes_read', 'bytes_written', 'games_in', 'games_kept',
+            'games_dropped', 'result_bytes')
+TIMERS = ('read', 'parse', 'transform', 'serialize', 'write', 'pickle')
+
+
+class StageMetrics:
+
+    def __init__(self, stage=None, task=None):
+        self.stage = stage
+        self.task = task
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.timers = dict.fromkeys(TIMERS, 0.0)
+
+    def add(self, name, value=1):
+        self.counters[name] += value
+
+    def add_time(self, name, seconds):
+        self.timers[name] += seconds
+
+    def record(self, wall):
+        return {
+            'stage': self.stage,
+            'task': self.task,
+            'pid': os.getpid(),
+            'wall': wall,
+            **self.counters,
+            **self.timers
+        }
+
+
+# 不在任务中时（例如主进程里）的计数记到这里，不会写出
+_idle_metrics = StageMetrics()
+_current_metrics = _idle_metrics
+_profilers = {}
+
+
+def current_metrics():
+    return _current_metrics
+
+
+def enable_metrics(metrics_path, profile_directory=None):
+    # 写入环境变量，之后启动的工作进程都会继承
+    os.environ[METRICS_ENV] = os.path.abspath(metrics_path)
+    if profile_directory is not None:
+        os.makedirs(profile_directory, exist_ok=True)
+        os.environ[PROFILE_ENV] = os.path.abspath(profile_directory)
+
+
+def run_task(stage, task, func, *args):
+    # 在工作进程中执行一个任务并记录指标；未开启时只多一次函数调用
+    global _current_metrics
+    metrics_path = os.environ.get(METRICS_ENV)
+    profile_directory = os.environ.get(PROFILE_ENV)
+    if not metrics_path and not profile_directory:
+        return func(*args)
+
+    metrics = StageMetrics(stage, task)
+    profiler = None
+    if profile_directory:
+        profiler = _profilers.get(stage)
+        if profiler is None:
+            profiler = _profilers[stage] = cProfile.Profile()
+        profiler.enable()
+    previous, _current_metrics = _current_metrics, metrics
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    finally:
+        _current_metrics = previous
+        wall = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(
+                os.path.join(profile_directory, f"{stage}_{os.getpid()}.prof"))
+
+    if metrics_path:
+        pickle_start = time.perf_counter()
+        metrics.add('result_bytes', len(pickle.dumps(result)))
+        metrics.add_time('pickle', time.perf_counter() - pickle_start)
+        # 每条记录一次写入，多个进程同时追加也不会交错
+        with open(metrics_path, 'a', encoding='utf-8') as file:
+            file.write(
+                json.dumps(metrics.record(wall), ensure_ascii=False) + '\n')
+    return result
+
+
+def load_metrics(metrics_path):
+    records = []
+    with open(metrics_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # 中断时只写了一半的最后一行
+    return records
+
+
+def summarize_metrics(records, by_worker=False):
+    # 按阶段（by_worker 为 True 时按阶段和进程）汇总各项计数和计时
+    summary = defaultdict(lambda: defaultdict(float))
+    for record in records:
+        key = (record['stage'],
+               record['pid']) if by_worker else (record['stage'], )
+        totals = summary[key]
+        totals['tasks'] += 1
+        totals['wall'] += record['wall']
+        for name in COUNTERS + TIMERS:
+            totals[name] += record.get(name, 0)
+    for totals in summary.values():
+        # pickle 在任务计时之外测量，不从 wall 中扣除
+        totals['other'] = totals['wall'] - sum(
+            totals[name] for name in TIMERS if name != 'pickle')
+    return {key: dict(totals) for key, totals in summary.items()}
+
+
+def print_summary(summary):
+    columns = ('tasks', 'games_in', 'games_kept',
+               'games_dropped') + TIMERS + ('other', 'wall')
+    print(f"{'stage':>16} " + ' '.join(f"{column:>12}" for column in columns) +
+          f" {'read_MB':>10} {'written_MB':>10}")
+    for key in sorted(summary, key=str):
+        totals = summary[key]
+        name = '/'.join(str(part) for part in key)
+        values = ' '.join(f"{totals[column]:>12.3f}" if column in TIMERS +
+                          ('other', 'wall') else f"{int(totals[column]):>12}"
+                          for column in columns)
+        print(f"{name:>16} {values} "
+              f"{totals['bytes_read'] / (1 << 20):>10.2f} "
+              f"{totals['bytes_written'] / (1 << 20):>10.2f}")
+
+
+if __name__ == "__main__":
+    metrics_path = r"E:\VSCPython\Amazons\dataset\metrics.jsonl"
+    print_summary(summarize_metrics(load_metrics(metrics_path)))
@@ -0,0 +1,177 @@
+import os
+import numpy as np
+from concurrent.futures import as_completed
+from tqdm import tqdm
+from game_store import (GameStore, STORE_CHUNK_GAMES, is_game_store,
+                        iter_json_games, iter_store_games)
+from data_process import Action, MOVE_ID_BITS, encode_move, move_id_to_str
+from json_stream import is_shard
+from overlap import make_executor, load_result
+from metrics import run_task
+
+# 开局库为按层序排列的前缀树，每个节点一条记录，根节点下标为 0：
+#   move         走到该节点的着法编号（根节点为 0）
+#   visits       经过该节点的对局数
+#   wins         其中走这一步的一方最终获胜的对局数
+#   first_child  第一个子节点的下标
+#   num_children 子节点个数
+# 同一节点的子节点连续存放并按着法编号升序排列，查询时逐层二分查找，文件可直接内存映射
+BOOK_DTYPE = np.dtype([('move', np.int32), ('visits', np.int32),
+                       ('wins', np.int32), ('first_child', np.int32),
+                       ('num_children', np.int32)])
+BOOK_DEPTH = 16
+
+
+def sequence_arrays(games, depth=BOOK_DEPTH):
+    # 每局只保留前 depth 步的着法编号，不足的位置填 -1
+    sequences = []
+    winners = []
+    for moves, winner, bots in games:
+        row = [encode_move(Action(*move)) for move in moves[:depth]]
+        sequences.extend(row + [-1] * (depth - len(row)))
+        winners.append(winner)
+    return (np.array(sequences, dtype=np.int64).reshape(-1, depth),
+            np.array(winners, dtype=np.int8))
+
+
+def process_file(file_path, depth=BOOK_DEPTH):
+    try:
+        return sequence_arrays(iter_json_games(file_path), depth)
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        return sequence_arrays([], depth)
+
+
+def process_store_chunk(store_path, start, stop, depth=BOOK_DEPTH):
+    return sequence_arrays(iter_store_games(store_path, start, stop), depth)
+
+
+def build_book(sequences, winners):
+    # 逐层把 (父节点, 着法) 去重排序，得到的新节点天然按父节点、着法有序，即层序排列
+    depth = sequences.shape[1]
+    node_moves = [np.zeros(1, dtype=np.int64)]
+    node_visits = [np.array([len(winners)], dtype=np.int64)]
+    node_wins = [np.zeros(1, dtype=np.int64)]
+    node_parents = [np.array([-1], dtype=np.int64)]
+    current = np.zeros(len(winners), dtype=np.int64)
+    total_nodes = 1
+
+    for ply in range(depth):
+        alive = sequences[:, ply] >= 0
+        keys = current[alive] << MOVE_ID_BITS | sequences[alive, ply]
+        if not len(keys):
+            break
+        level_keys, inverse = np.unique(keys, return_inverse=True)
+        node_moves.append(level_keys & ((1 << MOVE_ID_BITS) - 1))
+        node_parents.append(level_keys >> MOVE_ID_BITS)
+        node_visits.append(np.bincount(inverse, minlength=len(level_keys)))
+        node_wins.append(
+            np.bincount(inverse,
+                        weights=winners[alive] == ply % 2,
+                        minlength=len(level_keys)).astype(np.int64))
+        winners = winners[alive]
+        sequences = sequences[alive]
+        current = total_nodes + inverse
+        total_nodes += len(level_keys)
+
+    parents = np.concatenate(node_parents)[1:]
+    node_ids = np.arange(total_nodes)
+    first_child = np.searchsorted(parents, node_ids, side='left')
+    book = np.zeros(total_nodes, dtype=BOOK_DTYPE)
+    book['move'] = np.concatenate(node_moves)
+    book['visits'] = np.concatenate(node_visits)
+    book['wins'] = np.concatenate(node_wins)
+    book['first_child'] = first_child + 1
+    book['num_children'] = np.searchsorted(parents, node_ids,
+                                           side='right') - first_child
+    return book
+
+
+def save_book(book, book_path):
+    temp_path = book_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.save(file, book)
+    os.replace(temp_path, book_path)
+
+
+class OpeningBook:
+
+    def __init__(self, book_path):
+        # 去掉 memmap 子类只保留普通数组视图，数据仍按需从映射的文件中读取，但切片开销小得多
+        self.nodes = np.load(book_path, mmap_mode='r').view(np.ndarray)
+        self.moves = self.nodes['move']
+        self.first_child = self.nodes['first_child']
+        self.num_children = self.nodes['num_children']
+
+    def find(self, prefix):
+        # prefix 为着法编号或 Action 的序列，返回对应节点下标，库中没有时返回 -1
+        node = 0
+        for move in prefix:
+            if isinstance(move, Action):
+                move = encode_move(move)
+            start = int(self.first_child[node])
+            stop = start + int(self.num_children[node])
+            index = start + int(np.searchsorted(self.moves[start:stop], move))
+            if index == stop or self.moves[index] != move:
+                return -1
+            node = index
+        return node
+
+    def candidates(self, prefix):
+        # 返回 [(着法编号, 对局数, 胜局数), ...]，按对局数从多到少排列
+        node = self.find(prefix)
+        if node < 0:
+            return []
+        start = int(self.first_child[node])
+        children = self.nodes[start:start + int(self.num_children[node])]
+        order = np.argsort(-children['visits'], kind='stable')
+        return [(int(child['move']), int(child['visits']), int(child['wins']))
+                for child in children[order]]
+
+
+def process_directory(directory_path,
+                      book_path,
+                      depth=BOOK_DEPTH,
+                      max_workers=8,
+                      overlapped=False):
+    if is_game_store(directory_path):
+        total_games = len(GameStore(directory_path))
+        tasks = [(process_store_chunk, directory_path, start,
+                  start + STORE_CHUNK_GAMES, depth)
+                 for start in range(0, total_games, STORE_CHUNK_GAMES)]
+    else:
+        tasks = [(process_file, os.path.join(directory_path, file), depth)
+                 for file in sorted(os.listdir(directory_path))
+                 if is_shard(file)]
+
+    sequences = []
+    winners = []
+    with make_executor(max_workers, overlapped) as executor:
+        futures = [
+            executor.submit(run_task, 'opening_book', index, *task)
+            for index, task in enumerate(tasks)
+        ]
+        for future in tqdm(as_completed(futures),
+                           total=len(futures),
+                           desc="Building opening book"):
+            file_sequences, file_winners = load_result(future.result())
+            sequences.append(file_sequences)
+            winners.append(file_winners)
+
+    book = build_book(
+        np.concatenate(sequences) if sequences else np.zeros(
+            (0, depth), dtype=np.int64),
+        np.concatenate(winners) if winners else np.zeros(0, dtype=np.int8))
+    save_book(book, book_path)
+    return book
+
+
+if __name__ == "__main__":
+    directory_path = r"E:\VSCPython\Amazons\dataset\merge"
+    book_path = r"E:\VSCPython\Amazons\dataset\opening_book.npy"
+    book = process_directory(directory_path, book_path)
+    print(f"开局库共 {len(book)} 个节点: {book_path}")
+
+    opening_book = OpeningBook(book_path)
+    for move, visits, wins in opening_book.candidates([])[:10]:
+        print(move_id_to_str(move), visits, wins / visits)
@@ -0,0 +1,146 @@
+import os
+import struct
+import pickle
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from metrics import run_task
+
+# 读写与计算重叠的进程池：
+#   预读  后台线程按任务提交顺序把后面的文件读一遍放进系统缓存，工作进程读文件时直接命中缓存，
+#         磁盘和 CPU 同时工作；最多领先 max_workers + lookahead 个未完成的任务，不会把缓存挤满
+#   回传  工作进程里只序列化一次结果（pickle 协议 5，numpy 数组作为带外缓冲区）：
+#         不超过 RESULT_SPILL_BYTES 时把序列化好的数据经管道传回，进程池只需再拷贝一遍字节；
+#         超过时写入临时文件，只把路径经管道传回，主进程用 load_result 读回并删除临时文件
+# 临时文件放在 tempfile 的默认目录，可以用 TMPDIR 环境变量指定
+RESULT_SPILL_BYTES = 1 << 20
+PREFETCH_CHUNK = 1 << 20
+PickledResult = namedtuple('PickledResult', ['data', 'buffers'])
+SpilledResult = namedtuple('SpilledResult', ['path'])
+
+
+def warm_file(file_path):
+    buffer = bytearray(PREFETCH_CHUNK)
+    with open(file_path, 'rb', buffering=0) as file:
+        while file.readinto(buffer):
+            pass
+
+
+def task_file(func, args):
+    # 经 metrics.run_task 提交的任务前三个参数是阶段、任务名和实际执行的函数
+    if func is run_task:
+        args = args[3:]
+    return args[0] if args else None
+
+
+def spill_result(func, *args):
+    result = func(*args)
+    buffers = []
+    data = pickle.dumps(result, protocol=5, buffer_callback=buffers.append)
+    buffers = [buffer.raw() for buffer in buffers]
+    sizes = [len(data)] + [buffer.nbytes for buffer in buffers]
+    if sum(sizes) < RESULT_SPILL_BYTES:
+        # bytearray 还原出的 numpy 数组可写，与直接传回结果时相同
+        return PickledResult(data, [bytearray(buffer) for buffer in buffers])
+    fd, path = tempfile.mkstemp(prefix='amazons_result_', suffix='.pkl')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            # 文件头为缓冲区个数和各段长度，之后依次是 pickle 数据和各缓冲区
+            file.write(struct.pack(f'<Q{len(sizes)}Q', len(buffers), *sizes))
+            file.write(data)
+            for buffer in buffers:
+                file.write(buffer)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpilledResult(path)
+
+
+def load_result(value):
+    if isinstance(value, PickledResult):
+        return pickle.loads(value.data, buffers=value.buffers)
+    if not isinstance(value, SpilledResult):
+        return value
+    try:
+        with open(value.path, 'rb') as file:
+            count, = struct.unpack('<Q', file.read(8))
+            sizes = struct.unpack(f'<{count + 1}Q', file.read(8 * (count + 1)))
+            # 读进可写的 bytearray，还原出的 numpy 数组直接引用其中的数据，也可以原地修改
+            content = bytearray(sum(sizes))
+            file.readinto(content)
+    finally:
+        os.remove(value.path)
+    view = memoryview(content)
+    parts = []
+    offset = 0
+    for size in sizes:
+        parts.append(view[offset:offset + size])
+        offset += size
+    return pickle.loads(parts[0], buffers=parts[1:])
+
+
+def remove_spilled(future):
+    # 已经落盘但没有经 load_result 读回的结果
+    if future.done() and not future.cancelled() and future.exception() is None:
+        value = future.result()
+        if isinstance(value, SpilledResult):
+            try:
+                os.remove(value.path)
+            except FileNotFoundError:
+                pass
+
+
+class OverlappedExecutor:
+    # 用法与 ProcessPoolExecutor 相同；任务的第一个参数（经 run_task 提交时为实际函数的第一个参数）
+    # 是文件路径时预读该文件，future.result() 需经 load_result 取得实际结果
+
+    def __init__(self, max_workers=8, prefetch_threads=2, lookahead=None):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.prefetch_executor = ThreadPoolExecutor(
+            max_workers=prefetch_threads)
+        self.slots = threading.Semaphore(
+            max_workers + (max_workers if lookahead is None else lookahead))
+        self.futures = []
+
+    def submit(self, func, *args):
+        future = self.executor.submit(spill_result, func, *args)
+        # 每个任务占一个名额，完成（或取消）时归还；没有文件可预读的任务也占，保证名额数平衡
+        self.prefetch_executor.submit(self.prefetch, future,
+                                      task_file(func, args))
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def prefetch(self, future, file_path):
+        self.slots.acquire()
+        if future.done() or not isinstance(
+                file_path, str) or not os.path.isfile(file_path):
+            return
+        try:
+            warm_file(file_path)
+        except OSError:
+            pass  # 预读失败不影响任务本身，工作进程读文件时会报告错误
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self.prefetch_executor.shutdown(wait=wait)
+        if wait:
+            for future in self.futures:
+                remove_spilled(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 出错退出时先取消未开始的任务，归还名额，预读线程才能结束；
+        # 之后删除调用方没有读回的临时文件
+        self.shutdown(wait=True, cancel_futures=exc_type is not None)
+        return False
+
+
+def make_executor(max_workers=8, overlapped=False):
+    # 各阶段的 process_directory 通过 overlapped 选择进程池，结果统一经 load_result 取得
+    if overlapped:
+        return OverlappedExecutor(max_workers)
+    return ProcessPoolExecutor(max_workers=max_workers)
@@ -0,0 +1,184 @@
+import os
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from json_stream import iter_json_objects, is_shard, ShardWriter
+from filter_json_err import has_err
+from filter_logs import process_json_object
+from compress_json import is_valid_json
+from filter_bot import load_bot_ids, has_bot
+from manifest import Manifest, file_fingerprint
+from metrics import current_metrics, run_task
+
+
+def drop_err(obj):
+    return None if has_err(obj) else obj
+
+
+def drop_garbled(obj):
+    return obj if is_valid_json(obj) else None
+
+
+def keep_bots(obj, bot_ids):
+    return obj if has_bot(obj, bot_ids) else None
+
+
+def build_transforms(bot_ids=None):
+    # 顺序与原先逐个脚本执行时一致：去 err、精简日志、去乱码、按 bot 筛选
+    transforms = [drop_err, process_json_object, drop_garbled]
+    if bot_ids is not None:
+        transforms.append(partial(keep_bots, bot_ids=bot_ids))
+    return transforms
+
+
+def clean_games(objects, transforms):
+    metrics = current_metrics()
+    for obj in objects:
+        start = time.perf_counter()
+        try:
+            for transform in transforms:
+                obj = transform(obj)
+                if obj is None:
+                    break
+        except Exception as e:
+            # 结构异常的对象单独丢弃，计入 games_dropped，不影响同一文件夹的其他对象
+            print(f"处理对象时出错: {e}")
+            obj = None
+        metrics.add_time('transform', time.perf_counter() - start)
+        if obj is not None:
+            yield obj
+
+
+def process_folder(file_paths,
+                   output_directory,
+                   base_name,
+                   transforms,
+                   max_objects,
+                   with_fingerprint=False,
+                   max_bytes=None,
+                   compression=None):
+    fingerprints = None
+    if with_fingerprint:
+        fingerprints = [file_fingerprint(path) for path in file_paths]
+    games_in = 0
+
+    def read_games():
+        nonlocal games_in
+        for file_path in file_paths:
+            try:
+                for obj in iter_json_objects(file_path):
+                    games_in += 1
+                    yield obj
+            except Exception as e:
+                print(f"处理文件 {file_path} 时出错: {e}")
+
+    with ShardWriter(output_directory, base_name, max_objects, max_bytes,
+                     compression) as writer:
+        for obj in clean_games(read_games(), transforms):
+            writer.write(obj)
+    metrics = current_metrics()
+    metrics.add('games_in', games_in)
+    metrics.add('games_kept', writer.total)
+    metrics.add('games_dropped', games_in - writer.total)
+    return games_in, writer.total, writer.paths, fingerprints
+
+
+def shard_base_name(input_directory, root):
+    relative_path = os.path.relpath(root, input_directory)
+    if relative_path == os.curdir:
+        return os.path.basename(os.path.abspath(input_directory))
+    return relative_path.replace(os.sep, '_')
+
+
+def process_directory(input_directory,
+                      output_directory,
+                      bot_file_path=None,
+                      max_workers=8,
+                      max_objects=200,
+                      manifest_path=None,
+                      max_bytes=None,
+                      compression=None):
+    bot_ids = load_bot_ids(bot_file_path) if bot_file_path else None
+    transforms = build_transforms(bot_ids)
+
+    folders = {}
+    output_path = os.path.abspath(output_directory)
+    for root, dirs, files in os.walk(input_directory):
+        dirs[:] = [
+            dir for dir in dirs
+            if os.path.abspath(os.path.join(root, dir)) != output_path
+        ]
+        json_files = sorted(file for file in files if is_shard(file))
+        if json_files:
+            folders[root] = [os.path.join(root, file) for file in json_files]
+
+    # 文件夹内所有文件都未变化且产物仍在时跳过该文件夹
+    manifest = Manifest(manifest_path) if manifest_path else None
+    previous_outputs = {}
+    if manifest is not None:
+        recorded_inputs = {}
+        for path in manifest.inputs('pipeline'):
+            recorded_inputs.setdefault(os.path.dirname(path), set()).add(path)
+        for root in list(folders):
+            recorded = recorded_inputs.get(os.path.abspath(root), set())
+            current = {os.path.abspath(path) for path in folders[root]}
+            records = [manifest.lookup('pipeline', path) for path in recorded]
+            if recorded == current and all(records):
+                del folders[root]
+                continue
+            previous_outputs[root] = {
+                output
+                for record in records if record is not None
+                for output in record['outputs']
+            }
+            for path in recorded - current:
+                manifest.forget('pipeline', path)
+
+    total_in = total_kept = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        with_fingerprint = manifest is not None
+        for root, file_paths in folders.items():
+            base_name = shard_base_name(input_directory, root)
+            future = executor.submit(run_task, 'pipeline', root,
+                                     process_folder, file_paths,
+                                     output_directory, base_name, transforms,
+                                     max_objects, with_fingerprint, max_bytes,
+                                     compression)
+            futures[future] = root
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                games_in, kept, paths, fingerprints = future.result()
+                total_in += games_in
+                total_kept += kept
+                if manifest is not None:
+                    root = futures[future]
+                    outputs = {os.path.abspath(path) for path in paths}
+                    for stale in previous_outputs.get(root, set()) - outputs:
+                        if os.path.exists(stale):
+                            os.remove(stale)
+                    for path, fingerprint in zip(folders[root], fingerprints):
+                        manifest.record('pipeline', path, fingerprint, paths)
+            except Exception as e:
+                print(f"处理过程中出现错误: {e}")
+
+    if manifest is not None:
+        manifest.compact()
+
+    print(f"共读取 {total_in} 局，保留 {total_kept} 局")
+
+
+if __name__ == "__main__":
+    input_directory = r"E:\VSCPython\Amazons\dataset"
+    output_directory = r"E:\VSCPython\Amazons\dataset\merge"
+    bot_file_path = None
+    max_workers = 8
+    max_objects = 200
+    manifest_path = r"E:\VSCPython\Amazons\dataset\manifest.jsonl"
+    process_directory(input_directory,
+                      output_directory,
+                      bot_file_path=bot_file_path,
+                      max_workers=max_workers,
+                      max_objects=max_objects,
+                      manifest_path=manifest_path)
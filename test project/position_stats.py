@@ -0,0 +1,134 @@
+import os
+import numpy as np
+from concurrent.futures import as_completed
+from tqdm import tqdm
+from json_stream import is_shard
+from game_store import (GameStore, STORE_CHUNK_GAMES, is_game_store,
+                        iter_json_games, iter_store_games)
+from overlap import make_executor, load_result
+from metrics import run_task
+from data_process import Board
+
+# 按局面 Zobrist 哈希统计的紧凑表：keys 为升序排列且互不相同的 uint64 哈希，
+# visits、wins 与 keys 一一对应，分别为到达该局面的次数和走到该局面的一方最终获胜的次数。
+# 不同着法顺序到达的同一局面合并统计
+
+
+def new_position_stats():
+    return {
+        'keys': np.zeros(0, dtype=np.uint64),
+        'visits': np.zeros(0, dtype=np.int64),
+        'wins': np.zeros(0, dtype=np.int64)
+    }
+
+
+def build_position_stats(hashes, wins, visits=None):
+    keys, inverse = np.unique(np.asarray(hashes, dtype=np.uint64),
+                              return_inverse=True)
+    return {
+        'keys':
+        keys,
+        'visits':
+        np.bincount(inverse, weights=visits,
+                    minlength=len(keys)).astype(np.int64),
+        'wins':
+        np.bincount(inverse, weights=wins,
+                    minlength=len(keys)).astype(np.int64)
+    }
+
+
+def combine_position_stats(stats_list):
+    # 多张表一次合并，只排序去重一遍
+    stats_list = [new_position_stats()] + list(stats_list)
+    return build_position_stats(
+        np.concatenate([stats['keys'] for stats in stats_list]),
+        np.concatenate([stats['wins'] for stats in stats_list]),
+        np.concatenate([stats['visits'] for stats in stats_list]))
+
+
+def merge_position_stats(target, source):
+    return combine_position_stats([target, source])
+
+
+def lookup_position(stats, position_hash):
+    # 返回 (到达次数, 获胜次数)，未出现过的局面返回 (0, 0)
+    index = np.searchsorted(stats['keys'], np.uint64(position_hash))
+    if index < len(stats['keys']) and stats['keys'][index] == position_hash:
+        return int(stats['visits'][index]), int(stats['wins'][index])
+    return 0, 0
+
+
+def save_position_stats(stats, file_path):
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file, **stats)
+    os.replace(temp_path, file_path)
+
+
+def load_position_stats(file_path):
+    with np.load(file_path) as data:
+        return {key: data[key] for key in ('keys', 'visits', 'wins')}
+
+
+def replay_positions(games, max_ply=None):
+    # games 逐局产生 (着法序列, 胜方)，着法为 (x0, y0, x1, y1, x2, y2)；
+    # 记录每一步走完后的局面哈希，以及走这一步的一方是否获胜
+    hashes = []
+    wins = []
+    for moves, winner, bots in games:
+        chessboard = Board()
+        for i, (x0, y0, x1, y1, x2, y2) in enumerate(moves):
+            if max_ply is not None and i >= max_ply:
+                break
+            chessboard.move_piece(x0, y0, x1, y1)
+            chessboard.place_block(x2, y2)
+            hashes.append(chessboard.hash)
+            wins.append(i % 2 == winner)
+    return build_position_stats(hashes, wins)
+
+
+def process_file(file_path, max_ply=None):
+    try:
+        return replay_positions(iter_json_games(file_path), max_ply)
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        return new_position_stats()
+
+
+def process_store_chunk(store_path, start, stop, max_ply=None):
+    return replay_positions(iter_store_games(store_path, start, stop), max_ply)
+
+
+def process_directory(directory_path,
+                      max_ply=None,
+                      max_workers=8,
+                      overlapped=False):
+    if is_game_store(directory_path):
+        total_games = len(GameStore(directory_path))
+        tasks = [(process_store_chunk, directory_path, start,
+                  start + STORE_CHUNK_GAMES, max_ply)
+                 for start in range(0, total_games, STORE_CHUNK_GAMES)]
+    else:
+        tasks = [(process_file, os.path.join(directory_path, file), max_ply)
+                 for file in os.listdir(directory_path) if is_shard(file)]
+
+    # 各任务的表先收集起来，最后合并一次，避免每个任务都把已累计的整张表重新排序
+    task_stats = []
+    with make_executor(max_workers, overlapped) as executor:
+        futures = [
+            executor.submit(run_task, 'position_stats', index, *task)
+            for index, task in enumerate(tasks)
+        ]
+        for future in tqdm(as_completed(futures),
+                           total=len(futures),
+                           desc="Processing positions"):
+            task_stats.append(load_result(future.result()))
+    return combine_position_stats(task_stats)
+
+
+if __name__ == "__main__":
+    directory_path = r"E:\VSCPython\Amazons\dataset\merge"
+    output_path = r"E:\VSCPython\Amazons\dataset\position_stats.npz"
+    stats = process_directory(directory_path, max_ply=20)
+    save_position_stats(stats, output_path)
+    print(f"共统计 {len(stats['keys'])} 个不同局面: {output_path}")
@@ -0,0 +1,229 @@
+import os
+import re
+import mmap
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from data_process import Action, BitBoard, encode_move
+from json_backend import loads
+from json_stream import is_shard, shard_compression, open_shard
+from metrics import current_metrics, run_task
+
+# 索引记录每个分片中每局对局的字节偏移、字节长度和步数，采样时直接 seek 到对局所在位置读取，
+# 不需要把整个分片 json.load 进内存
+# 字符串字面量整体匹配，其中的花括号不参与计数；引号、反斜杠和花括号都是单字节，按字节扫描即可
+_BRACE_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]')
+
+
+def scan_game_offsets(data):
+    # 返回顶层对象（即每局对局）的 (起始字节, 结束字节) 列表
+    spans = []
+    depth = 0
+    start = 0
+    for match in _BRACE_TOKEN.finditer(data):
+        token = match.group()
+        if token == b'{':
+            if depth == 0:
+                start = match.start()
+            depth += 1
+        elif token == b'}':
+            depth -= 1
+            if depth == 0:
+                spans.append((start, match.end()))
+    return spans
+
+
+def index_data(data, offsets, lengths, plies):
+    for start, end in scan_game_offsets(data):
+        obj = loads(data[start:end])
+        offsets.append(start)
+        lengths.append(end - start)
+        plies.append(max(len(obj["log"]) - 1, 0))
+
+
+def index_file(file_path):
+    offsets = []
+    lengths = []
+    plies = []
+    try:
+        current_metrics().add('bytes_read', os.path.getsize(file_path))
+        if shard_compression(file_path):
+            # 压缩分片不能内存映射，整体解压后扫描，偏移量为解压后数据中的位置
+            with open_shard(file_path, 'rb') as file:
+                index_data(file.read(), offsets, lengths, plies)
+        elif os.path.getsize(file_path) > 0:
+            with open(file_path, 'rb') as file, mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                index_data(data, offsets, lengths, plies)
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        offsets, lengths, plies = [], [], []
+    current_metrics().add('games_in', len(offsets))
+    return (np.array(offsets, dtype=np.int64), np.array(lengths,
+                                                        dtype=np.int64),
+            np.array(plies, dtype=np.int32))
+
+
+def build_index(directory_path, index_path, max_workers=8):
+    file_paths = [
+        os.path.join(directory_path, file)
+        for file in sorted(os.listdir(directory_path)) if is_shard(file)
+    ]
+    file_ids, offsets, lengths, plies = [], [], [], []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(run_task, 'sampler_index', file_path, index_file,
+                            file_path) for file_path in file_paths
+        ]
+        for file_id, future in enumerate(tqdm(futures, desc="Indexing games")):
+            file_offsets, file_lengths, file_plies = future.result()
+            file_ids.append(np.full(len(file_offsets), file_id,
+                                    dtype=np.int32))
+            offsets.append(file_offsets)
+            lengths.append(file_lengths)
+            plies.append(file_plies)
+
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file,
+                 files=np.array(file_paths),
+                 file_ids=np.concatenate(file_ids or [np.zeros(0, np.int32)]),
+                 offsets=np.concatenate(offsets or [np.zeros(0, np.int64)]),
+                 lengths=np.concatenate(lengths or [np.zeros(0, np.int64)]),
+                 plies=np.concatenate(plies or [np.zeros(0, np.int32)]))
+    os.replace(temp_path, index_path)
+
+
+sampler_files = None
+open_files = {}
+
+
+def attach_sampler_files(file_paths):
+    # fork 出的工作进程不能沿用父进程的文件句柄，否则各进程共享同一个读写位置
+    global sampler_files, open_files
+    sampler_files = file_paths
+    open_files = {}
+
+
+def read_game(file_id, offset, length):
+    # 每个工作进程为每个分片只打开一次文件句柄；压缩分片的 seek 需要解压到目标位置，
+    # 往后 seek 时接着解压即可，往回 seek 时要从头解压，load_samples 已按位置排序读取
+    file = open_files.get(file_id)
+    if file is None:
+        file = open_files[file_id] = open_shard(sampler_files[file_id], 'rb')
+    file.seek(offset)
+    return loads(file.read(length))
+
+
+def replay_planes(log, ply):
+    # 复盘到第 ply 步之前，返回黑、白、障碍三个位棋盘
+    chessboard = BitBoard()
+    black, white, arrows = chessboard.black, chessboard.white, chessboard.arrows
+    for i in range(ply):
+        response = log[i][str(i % 2)]["response"]
+        path = (1 << (response["x0"] * 8 + response["y0"])
+                | 1 << (response["x1"] * 8 + response["y1"]))
+        if i % 2 == 0:
+            black ^= path
+        else:
+            white ^= path
+        arrows |= 1 << (response["x2"] * 8 + response["y2"])
+    return black, white, arrows
+
+
+def load_samples(samples):
+    # samples 为 (分片编号, 偏移, 长度, 步数) 的列表，按文件位置排序后读取以减少随机寻道，
+    # 结果按传入顺序返回
+    count = len(samples)
+    planes = np.zeros((count, 3), dtype=np.uint64)
+    moves = np.zeros(count, dtype=np.int32)
+    outcomes = np.zeros(count, dtype=np.int8)
+    for k in sorted(range(count), key=lambda k: samples[k][:2]):
+        file_id, offset, length, ply = samples[k]
+        obj = read_game(file_id, offset, length)
+        log = obj["log"]
+        planes[k] = replay_planes(log, ply)
+        response = log[ply][str(ply % 2)]["response"]
+        moves[k] = encode_move(
+            Action(response["x0"], response["y0"], response["x1"],
+                   response["y1"], response["x2"], response["y2"]))
+        winner = 0 if obj["scores"][0] == 2 else 1
+        outcomes[k] = 1 if winner == ply % 2 else -1
+    # 第 x * 8 + y 位展开后正好对应 boards[k, plane, x, y]
+    boards = np.unpackbits(planes.view(np.uint8), bitorder='little')
+    return boards.reshape(count, 3, 8, 8), moves, outcomes
+
+
+class PositionSampler:
+    # 按局面均匀有放回地采样，逐批产生 (boards, moves, outcomes)：
+    #   boards   (batch, 3, 8, 8) uint8，依次为黑子、白子、障碍
+    #   moves    该局面下实际走出的着法编号
+    #   outcomes 行棋方最终获胜为 1，否则为 -1
+
+    def __init__(self,
+                 index_path,
+                 batch_size=1024,
+                 max_workers=8,
+                 prefetch=16,
+                 seed=None):
+        with np.load(index_path) as index:
+            self.files = index['files'].tolist()
+            self.file_ids = index['file_ids']
+            self.offsets = index['offsets']
+            self.lengths = index['lengths']
+            plies = index['plies']
+        self.position_starts = np.cumsum(plies) - plies
+        self.total_positions = int(plies.sum())
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.rng = np.random.default_rng(seed)
+        self.executor = ProcessPoolExecutor(max_workers=max_workers,
+                                            initializer=attach_sampler_files,
+                                            initargs=(self.files, ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def sample_batch(self):
+        positions = self.rng.integers(0, self.total_positions, self.batch_size)
+        games = np.searchsorted(self.position_starts, positions,
+                                side='right') - 1
+        plies = positions - self.position_starts[games]
+        return list(
+            zip(self.file_ids[games].tolist(), self.offsets[games].tolist(),
+                self.lengths[games].tolist(), plies.tolist()))
+
+    def batches(self, num_batches=None):
+        # 始终保持 prefetch 个批次在工作进程中处理，按提交顺序产出
+        pending = []
+        submitted = 0
+        while True:
+            while len(pending) < self.prefetch and (num_batches is None or
+                                                    submitted < num_batches):
+                pending.append(
+                    self.executor.submit(load_samples, self.sample_batch()))
+                submitted += 1
+            if not pending:
+                return
+            yield pending.pop(0).result()
+
+    def __iter__(self):
+        return self.batches()
+
+
+if __name__ == "__main__":
+    directory_path = r"E:\VSCPython\Amazons\dataset\merge"
+    index_path = r"E:\VSCPython\Amazons\dataset\game_index.npz"
+    build_index(directory_path, index_path)
+
+    with PositionSampler(index_path, seed=0) as sampler:
+        for boards, moves, outcomes in tqdm(sampler.batches(100),
+                                            total=100,
+                                            desc="Sampling positions"):
+            pass
@@ -0,0 +1,125 @@
+import os
+import json
+import random
+from data_process import BitBoard, expand_move_bitboard
+
+# 生成与原始对局存档结构相同的随机合法对局，用于基准测试和回归比对。
+# 着法由 expand_move_bitboard 生成，与 Board + expand_move 的着法及其顺序完全一致，但快得多。
+# 每局对局的结构：
+#   players  双方的 type 和 bot
+#   log      裁判的 request 与双方的 "0"/"1" 回应交替出现，最后是 finish
+#   scores   胜方 2 分，负方 0 分
+# 按比例混入含 err 的对局、含乱码的对局和有人类玩家的对局，覆盖各清洗阶段
+SYNTHETIC_SEED = 0
+# 生成规则改变时加一，基准测试缓存的数据集随之重新生成
+SYNTHETIC_VERSION = 2
+MOVE_FIELDS = ("x0", "y0", "x1", "y1", "x2", "y2")
+# BMP 以外的字符，compress_json 将其视为乱码；写出时转义为 \uXXXX 代理对
+GARBLED_TEXTS = ('\U0001f600', '\U0002a6a5')
+
+
+def random_moves(rng):
+    chessboard = BitBoard()
+    player = 1
+    moves = []
+    while True:
+        legal_moves = list(expand_move_bitboard(chessboard, player))
+        if not legal_moves:
+            return moves
+        move = rng.choice(legal_moves)
+        chessboard.move_piece(*move[:4])
+        chessboard.place_block(*move[4:])
+        moves.append(move)
+        player = -player
+
+
+def random_game(rng, bots, err_rate=0.05, garbled_rate=0.05, human_rate=0.05):
+    moves = random_moves(rng)
+    # 无子可走的一方判负
+    winner = 1 - len(moves) % 2
+    log = []
+    for i, move in enumerate(moves):
+        key = str(i % 2)
+        log.append({
+            "output": {
+                "command": "request",
+                "content": {
+                    key: {}
+                },
+                "display": {}
+            }
+        })
+        log.append({
+            key: {
+                "response": dict(zip(MOVE_FIELDS, move)),
+                "verdict": "OK",
+                "time": rng.randrange(1000),
+                "memory": rng.randrange(1, 100),
+                "keep_running": False,
+                "debug": ""
+            }
+        })
+
+    display = {"winner": winner}
+    if rng.random() < err_rate:
+        display["err"] = "INVALID_INPUT_VERDICT_RE"
+    if rng.random() < garbled_rate:
+        # 乱码一半写在 finish 的 display 里（精简日志时删掉），一半写在某一步的回应里（一直保留到去乱码）
+        text = rng.choice(GARBLED_TEXTS)
+        if moves and rng.random() < 0.5:
+            i = rng.randrange(len(moves))
+            log[2 * i + 1][str(i % 2)]["response"]["msg"] = text
+        else:
+            display["msg"] = text
+    log.append({
+        "output": {
+            "command": "finish",
+            "display": display
+        },
+        "memory": 0,
+        "time": 0
+    })
+
+    players = [{"type": "bot", "bot": rng.choice(bots)} for _ in range(2)]
+    if rng.random() < human_rate:
+        players[rng.randrange(2)] = {"type": "human", "bot": None}
+    return {
+        "initdata": "",
+        "players": players,
+        "log": log,
+        "scores": [2, 0] if winner == 0 else [0, 2]
+    }
+
+
+def write_dataset(output_directory,
+                  num_games,
+                  games_per_file=200,
+                  folders=2,
+                  num_bots=20,
+                  seed=SYNTHETIC_SEED,
+                  **rates):
+    # 原始存档的格式：每个文件由逐行首尾相接的对象组成，非 ASCII 字符转义；对局轮流分到各子文件夹
+    rng = random.Random(seed)
+    bots = [f"{rng.getrandbits(48):012x}" for _ in range(num_bots)]
+    file_paths = []
+    written = 0
+    while written < num_games:
+        folder = os.path.join(output_directory,
+                              f"folder{len(file_paths) % folders}")
+        os.makedirs(folder, exist_ok=True)
+        file_path = os.path.join(folder,
+                                 f"raw{len(file_paths) // folders}.json")
+        count = min(games_per_file, num_games - written)
+        with open(file_path, 'w', encoding='utf-8') as file:
+            for _ in range(count):
+                game = random_game(rng, bots, **rates)
+                file.write(json.dumps(game) + '\n')
+        file_paths.append(file_path)
+        written += count
+    return file_paths
+
+
+if __name__ == "__main__":
+    output_directory = r"E:\VSCPython\Amazons\synthetic\dataset"
+    file_paths = write_dataset(output_directory, 1000)
+    print(f"已生成 {len(file_paths)} 个文件: {output_directory}")
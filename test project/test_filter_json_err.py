@@ -0,0 +1,19 @@
+import json
+from filter_json_err import remove_err_objects
+
+
+def test_empty_shard_is_deleted(tmp_path):
+    file_path = tmp_path / 'empty.json'
+    file_path.write_text('[]', encoding='utf-8')
+    assert remove_err_objects(str(file_path))
+    assert not file_path.exists()
+
+
+def test_string_display_with_err_is_removed(tmp_path):
+    file_path = tmp_path / 'games.json'
+    kept = {"log": [{"output": {"display": {"x": 1}}}]}
+    games = [kept, {"log": [{"output": {"display": "runtime error"}}]}]
+    file_path.write_text(json.dumps(games), encoding='utf-8')
+    assert remove_err_objects(str(file_path))
+    with open(file_path, encoding='utf-8') as file:
+        assert json.load(file) == [kept]
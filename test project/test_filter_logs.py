@@ -0,0 +1,37 @@
+import copy
+import json
+import random
+from filter_logs import process_json_object, process_json_file
+from json_stream import rewrite_if_changed
+from synthetic import random_game
+
+
+def short_game(moves):
+    # 截成 moves 步：request 与回应交替，最后是 finish
+    game = random_game(random.Random(moves), ['bot_a', 'bot_b'])
+    game['log'] = game['log'][:2 * moves] + game['log'][-1:]
+    return game
+
+
+def test_process_json_object_is_idempotent():
+    for moves in range(8, 14):
+        game = short_game(moves)
+        once = process_json_object(copy.deepcopy(game))
+        assert (once is None) == (len(game['log']) <= 20)
+        if once is not None:
+            assert process_json_object(copy.deepcopy(once)) == once
+
+
+def test_rerun_does_not_change_file(tmp_path):
+    file_path = tmp_path / 'games.json'
+    file_path.write_text('\n'.join(
+        json.dumps(short_game(moves)) for moves in range(8, 14)),
+                         encoding='utf-8')
+    assert process_json_file(str(file_path))
+    with open(file_path, encoding='utf-8') as file:
+        first = json.load(file)
+    assert len(first) == 4
+
+    assert rewrite_if_changed(str(file_path), process_json_object) is None
+    with open(file_path, encoding='utf-8') as file:
+        assert json.load(file) == first
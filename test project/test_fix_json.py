@@ -0,0 +1,49 @@
+import json
+import time
+from fix_json import scan_json_objects, fix_json_file
+
+
+def test_concatenated_objects_after_truncated_object():
+    content = '{"a": 1}{"b": [1, 2' + '{"a": 1}' * 3
+    json_objects, corrupt_spans = scan_json_objects(content)
+    assert json_objects == [{"a": 1}] * 4
+    assert corrupt_spans == [(8, 19)]
+
+
+def test_balanced_corrupt_object_is_skipped_whole():
+    content = '{"x": {"y": 1}, bad}\n{"a": 1}\n'
+    json_objects, corrupt_spans = scan_json_objects(content)
+    assert json_objects == [{"a": 1}]
+    assert corrupt_spans == [(0, 20)]
+
+
+def test_braces_inside_strings_are_ignored():
+    content = '{"b": "{{", "c": [1\n{"a": "}{"}\n'
+    json_objects, corrupt_spans = scan_json_objects(content)
+    assert json_objects == [{"a": "}{"}]
+    assert len(corrupt_spans) == 1
+
+
+def test_many_truncated_lines_scan_in_linear_time():
+
+    def scan_seconds(lines):
+        content = '{"a": 1}\n{"b": [1, 2\n' * lines
+        start = time.perf_counter()
+        json_objects, corrupt_spans = scan_json_objects(content)
+        assert len(json_objects) == len(corrupt_spans) == lines
+        return time.perf_counter() - start
+
+    # 规模翻四倍，平方复杂度时耗时约为 16 倍
+    small = scan_seconds(2000)
+    large = scan_seconds(8000)
+    assert large < max(small, 0.01) * 8
+
+
+def test_fix_json_file_recovers_objects(tmp_path):
+    file_path = tmp_path / 'raw.json'
+    file_path.write_text('{"a": 1}{"b": [1, 2' + '{"a": 2}\n' * 2,
+                         encoding='utf-8')
+    byte_spans = fix_json_file(str(file_path), recover=True)
+    assert byte_spans == [(8, 19)]
+    with open(file_path, encoding='utf-8') as file:
+        assert json.load(file) == [{"a": 1}, {"a": 2}, {"a": 2}]